@@ -0,0 +1,79 @@
+import itertools
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Thread
+from typing import Any, Callable, Hashable
+
+import metrics
+import tracing
+
+
+class ActionQueue:
+    """Runs actions on the stream windows (switching away from/back to the main stream,
+    toggling fullscreen) one at a time in its own thread, in the order they were
+    submitted. Actions are submitted from the event loop (see
+    StreamManager.run_action), and running them here keeps them from blocking it or
+    interleaving and switching twice.
+
+    Actions submitted with the same key replace each other while waiting to run, so
+    that only the latest one runs (e.g. a switch away that is superseded by a switch
+    back before it started).
+    """
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        # keys: action keys in the order they will run, values: action and future that
+        # completes once it (or an action that replaced it) has run
+        self.pending: OrderedDict[Hashable, tuple[Callable[[], Any], Future]] = (
+            OrderedDict()
+        )
+        self.unique_keys = itertools.count()
+        self.closed = False
+        self.thread = Thread(target=self._run_forever, name="actions", daemon=True)
+        self.thread.start()
+
+    def submit(self, action: Callable[[], Any], key: Hashable = None) -> Future:
+        """Queue action and return future for its result. If an action with the same
+        key is still waiting to run, it is replaced by this one and both futures get
+        this one's result. Actions without a key are never replaced."""
+        if key is None:
+            key = ("unique", next(self.unique_keys))
+        action = tracing.in_current_span(action)
+
+        with self.condition:
+            if self.closed:
+                raise Exception("Action queue is closed")
+            if key in self.pending:
+                _, future = self.pending.pop(key)
+                metrics.coalesced_actions.inc()
+            else:
+                future = Future()
+            # latest action runs in the position of the latest submission
+            self.pending[key] = (action, future)
+            self.condition.notify()
+
+        return future
+
+    def close(self) -> None:
+        """Stop once the actions that are already queued have run"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _run_forever(self) -> None:
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                _, (action, future) = self.pending.popitem(last=False)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = action()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
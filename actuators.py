@@ -0,0 +1,174 @@
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock, local
+from typing import Callable, Iterator
+
+import metrics
+import tracing
+from browser_control import BrowserController
+from constants import ACTUATOR_WORKERS, AUDIO_STATE_MAX_AGE, SELF_FOCUS_MAX_AGE
+from utils import YabaiBatch, cover_window
+from window_registry import WindowRegistry
+
+
+class WindowActuator(ABC):
+    """Everything StreamManager does to the stream windows once setup is done: query
+    them, mute/unmute them, focus them, cover them and toggle fullscreen. Keeping it
+    behind one object lets the decision logic run without yabai or a browser (see
+    replay.py).
+    """
+
+    @abstractmethod
+    def get_windows(self) -> list[dict]:
+        """Return ID, focus and fullscreen state of each window, like
+        utils.get_windows"""
+
+    @abstractmethod
+    def set_muted(self, win_id: int, mute: bool = True) -> None:
+        pass
+
+    @abstractmethod
+    def focus(self, win_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def cover(self, win_id: int, cover_id: int) -> None:
+        """Move cover window on top of given window"""
+
+    @abstractmethod
+    def toggle_fullscreen(self, win_id: int) -> None:
+        pass
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Window commands (focus, cover, toggle fullscreen) in the with block may be
+        collected and run together when it ends"""
+        yield
+
+    def run_parallel(self, *actions: Callable[[], None]) -> None:
+        """Run independent actions (e.g. muting different windows), possibly at the
+        same time, and return once all are done. Actions that depend on each other
+        (e.g. unmuting a window after focusing it) must be in the same function."""
+        for action in actions:
+            action()
+
+    def focused_by_self(self, win_id: int) -> bool:
+        """Whether window was recently focused by this actuator, as opposed to by the
+        user (whose yabai focus signals look the same)"""
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+class YabaiActuator(WindowActuator):
+    """Control windows with yabai and the browser, reading window state from registry
+    instead of querying yabai and keeping it up to date with what it changes. Commands
+    that wouldn't change anything (focusing the focused window, muting a window that
+    was just muted) are skipped."""
+
+    def __init__(self, registry: WindowRegistry, browser: BrowserController) -> None:
+        self.registry = registry
+        self.browser = browser
+        self.executor = ThreadPoolExecutor(
+            max_workers=ACTUATOR_WORKERS, thread_name_prefix="actuator"
+        )
+        # batch being collected by each thread
+        self.batches = local()
+        self.lock = Lock()
+        # keys: window IDs, values: whether window was last muted (True) or unmuted
+        # (False) and when
+        self.muted: dict[int, tuple[bool, float]] = {}
+        # keys: IDs of windows focused by focus(), values: when
+        self.focused: dict[int, float] = {}
+
+    @property
+    def pending_batch(self) -> YabaiBatch | None:
+        return getattr(self.batches, "pending", None)
+
+    def get_windows(self) -> list[dict]:
+        return self.registry.get_windows()
+
+    def set_muted(self, win_id: int, mute: bool = True) -> None:
+        with self.lock:
+            known = self.muted.get(win_id)
+        if (
+            known is not None
+            and known[0] == mute
+            and time.time() - known[1] < AUDIO_STATE_MAX_AGE
+        ):
+            metrics.skipped_window_commands.inc(command="mute" if mute else "unmute")
+            return
+
+        try:
+            self.browser.set_muted(win_id, mute=mute)
+        except Exception:
+            # page may be in either state now
+            with self.lock:
+                self.muted.pop(win_id, None)
+            raise
+        with self.lock:
+            self.muted[win_id] = (mute, time.time())
+
+    def focus(self, win_id: int) -> None:
+        focused = [win["id"] for win in self.get_windows() if win["focus"]]
+        # commands that are already batched may change focus, so can't skip then
+        if focused == [win_id] and self.pending_batch is None:
+            metrics.skipped_window_commands.inc(command="focus")
+            return
+
+        # before focusing, since yabai's signal for it can arrive right away
+        with self.lock:
+            self.focused[win_id] = time.time()
+        with self.batch():
+            self.pending_batch.add(win_id, "--focus")
+        self.registry.set_focused(win_id)
+
+    def focused_by_self(self, win_id: int) -> bool:
+        with self.lock:
+            focused_time = self.focused.get(win_id)
+        return (
+            focused_time is not None and time.time() - focused_time < SELF_FOCUS_MAX_AGE
+        )
+
+    def cover(self, win_id: int, cover_id: int) -> None:
+        cover_window(self.registry.frame(win_id), cover_id, self.pending_batch)
+        self.registry.set_focused(cover_id)
+
+    def toggle_fullscreen(self, win_id: int) -> None:
+        with self.batch():
+            self.pending_batch.add(win_id, "--toggle", "zoom-fullscreen")
+        self.registry.toggle_fullscreen(win_id)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        # nested batches are part of the outermost one
+        if self.pending_batch is not None:
+            yield
+            return
+
+        self.batches.pending = YabaiBatch()
+        try:
+            yield
+            self.batches.pending.run()
+        finally:
+            self.batches.pending = None
+
+    def run_parallel(self, *actions: Callable[[], None]) -> None:
+        if len(actions) <= 1:
+            super().run_parallel(*actions)
+            return
+
+        futures = [
+            self.executor.submit(tracing.in_current_span(action)) for action in actions
+        ]
+        # wait for all before raising first error, so no action is still running
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,285 @@
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from classifier import Classifier
+from constants import (
+    BACKGROUND_SCORE_MAX_AGE,
+    BACKGROUND_SCORE_MIN_INTERVAL,
+    COMMERCIAL_ENTER_THRESHOLD,
+    INFERENCE_BUDGET,
+    NEXT_TARGET_WEIGHT,
+    RECENT_COMMERCIAL_SECONDS,
+    RECENT_COMMERCIAL_WEIGHT,
+    SAMPLE_RATE_WINDOW,
+)
+
+
+class BackgroundScorer:
+    """Keeps recent scores of the streams other than the main one by classifying them
+    in a background thread, so that switching away from the main stream can pick the
+    stream to switch to without classifying all other streams first.
+
+    Classifying costs CPU, so all windows together are classified at most budget times
+    per second. The main loop's checks of the main stream come first, and what is left
+    is shared between the other streams by priority: the stream that would be switched
+    to next is classified most often, then streams that showed a commercial recently
+    (so that it's noticed when they return to the game), then the rest. With many
+    streams, low priority ones may only be classified every minute or so.
+    """
+
+    def __init__(
+        self,
+        classifier: Classifier,
+        get_win_ids: Callable[[], list[int]],
+        on_scores: Callable[[dict[int, float]], None] = lambda scores: None,
+        budget: float = INFERENCE_BUDGET,
+        main_rate: float = 0,
+        max_age: float = BACKGROUND_SCORE_MAX_AGE,
+        min_interval: float = BACKGROUND_SCORE_MIN_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """get_win_ids returns the IDs of the windows to score (i.e. all but the main
+        one), and on_scores is called with the scores of each round. budget is the
+        number of frames per second that may be classified in total, of which
+        main_rate (at least) is used by the main loop."""
+        self.classifier = classifier
+        self.get_win_ids = get_win_ids
+        self.on_scores = on_scores
+        self.budget = budget
+        self.main_rate = main_rate
+        self.max_age = max_age
+        self.min_interval = min_interval
+        self.clock = clock
+        self.lock = Lock()
+        # keys: window IDs, values: latest score and when the window was captured for
+        # it
+        self.scores: dict[int, tuple[float, float]] = {}
+        # keys: window IDs, values: last time window scored as a commercial
+        self.last_commercial: dict[int, float] = {}
+        # keys: window IDs, values: times window was classified within the last
+        # SAMPLE_RATE_WINDOW seconds
+        self.samples: dict[int, deque[float]] = {}
+        self.start_time = clock()
+        self.requested = Event()
+
+        if budget <= main_rate:
+            print(
+                f"Inference budget of {budget} frames/s is used up by checking the"
+                " main stream, other streams will only be classified when switching"
+                " to them."
+            )
+
+    def start(self) -> None:
+        Thread(target=self._score_forever, daemon=True).start()
+
+    def _score_forever(self) -> None:
+        while True:
+            # check again after max_age at the latest in case windows or budget change
+            timeout = min(max(self.next_due() - self.clock(), 0), self.max_age)
+            self.requested.wait(timeout)
+            try:
+                self.score_now()
+            except Exception as e:
+                print(f"Unable to score windows in background: {e}")
+                # don't retry right away
+                time.sleep(self.min_interval)
+
+    def request_soon(self) -> None:
+        """Classify the stream that would be switched to next and the ones with the
+        oldest scores right away instead of waiting for their turn (e.g. because main
+        stream may be going to commercial), as far as the budget allows"""
+        self.requested.set()
+
+    def sample_duration(self) -> float:
+        """Return number of seconds sample_rates are averaged over"""
+        return min(max(self.clock() - self.start_time, 1), SAMPLE_RATE_WINDOW)
+
+    def sample_rates(self) -> dict[int, float]:
+        """Return number of times each window was classified per second over the last
+        SAMPLE_RATE_WINDOW seconds"""
+        now = self.clock()
+        duration = self.sample_duration()
+        with self.lock:
+            for samples in self.samples.values():
+                while len(samples) > 0 and now - samples[0] > SAMPLE_RATE_WINDOW:
+                    samples.popleft()
+            return {
+                win_id: len(samples) / duration
+                for win_id, samples in self.samples.items()
+            }
+
+    def available_rate(self, rates: dict[int, float], win_ids: list[int]) -> float:
+        """Return frames per second left of the budget for the given windows, given
+        sample_rates"""
+        main_rate = max(
+            self.main_rate,
+            sum(rate for win_id, rate in rates.items() if win_id not in win_ids),
+        )
+        return self.budget - main_rate
+
+    def next_target(self, win_ids: list[int]) -> int | None:
+        """Return ID of window that would be switched to next based on recent
+        scores"""
+        recent = self.recent_scores(win_ids)
+        game_ids = [
+            win_id
+            for win_id, score in recent.items()
+            if score < COMMERCIAL_ENTER_THRESHOLD
+        ]
+        return min(game_ids, key=lambda win_id: recent[win_id], default=None)
+
+    def intervals(self, win_ids: list[int]) -> dict[int, float]:
+        """Return how many seconds should pass between classifications of each given
+        window to share what's left of the budget by priority"""
+        available = self.available_rate(self.sample_rates(), win_ids)
+        if available <= 0 or len(win_ids) == 0:
+            return {win_id: float("inf") for win_id in win_ids}
+
+        now = self.clock()
+        next_target = self.next_target(win_ids)
+
+        weights = {}
+        with self.lock:
+            for win_id in win_ids:
+                last_commercial = self.last_commercial.get(win_id)
+                if win_id == next_target:
+                    weights[win_id] = NEXT_TARGET_WEIGHT
+                elif (
+                    last_commercial is not None
+                    and now - last_commercial <= RECENT_COMMERCIAL_SECONDS
+                ):
+                    weights[win_id] = RECENT_COMMERCIAL_WEIGHT
+                else:
+                    weights[win_id] = 1
+
+        total_weight = sum(weights.values())
+        return {
+            win_id: max(total_weight / (weight * available), self.min_interval)
+            for win_id, weight in weights.items()
+        }
+
+    def due_times(self, win_ids: list[int] | None = None) -> dict[int, float]:
+        """Return time when each given window (default all to score) should be
+        classified next by its interval (inf if only when switching to it)"""
+        if win_ids is None:
+            win_ids = self.get_win_ids()
+        intervals = self.intervals(win_ids)
+
+        due_times = {}
+        with self.lock:
+            for win_id, interval in intervals.items():
+                if interval == float("inf"):
+                    due_times[win_id] = interval
+                elif win_id not in self.scores:
+                    due_times[win_id] = self.clock()
+                else:
+                    due_times[win_id] = self.scores[win_id][1] + interval
+
+        if self.requested.is_set():
+            # early round: everything whose score could change, the most important
+            # first (due_ids only takes what the budget allows)
+            now = self.clock()
+            with self.lock:
+                for win_id in win_ids:
+                    if (
+                        win_id not in self.scores
+                        or now - self.scores[win_id][1] >= self.min_interval
+                    ):
+                        due_times[win_id] = min(due_times[win_id], now)
+        return due_times
+
+    def allowance(self, win_ids: list[int]) -> int:
+        """Return how many of the given windows can be classified now without going
+        over the budget across the last SAMPLE_RATE_WINDOW seconds"""
+        rates = self.sample_rates()
+        duration = self.sample_duration()
+        used = sum(rates.get(win_id, 0) for win_id in win_ids) * duration
+        return max(int(self.available_rate(rates, win_ids) * duration - used), 0)
+
+    def by_priority(self, win_ids: list[int], all_win_ids: list[int]) -> list[int]:
+        """Return given windows sorted by how urgently they need a new score: the one
+        that would be switched to next, then the ones with the oldest scores"""
+        next_target = self.next_target(all_win_ids)
+        with self.lock:
+            return sorted(
+                win_ids,
+                key=lambda win_id: (
+                    win_id != next_target,
+                    self.scores.get(win_id, (0, float("-inf")))[1],
+                ),
+            )
+
+    def due_ids(self) -> list[int]:
+        """Return IDs of windows that should be classified now, the most urgent first
+        and only as many as the budget allows"""
+        win_ids = self.get_win_ids()
+        now = self.clock()
+        due_ids = [
+            win_id
+            for win_id, due_time in self.due_times(win_ids).items()
+            if due_time <= now
+        ]
+        return self.by_priority(due_ids, win_ids)[: self.allowance(win_ids)]
+
+    def next_due(self) -> float:
+        """Return time when next window should be classified"""
+        win_ids = self.get_win_ids()
+        next_due = min(self.due_times(win_ids).values(), default=float("inf"))
+        if self.allowance(win_ids) == 0:
+            # wait for budget to free up
+            available = self.available_rate(self.sample_rates(), win_ids)
+            if available <= 0:
+                return float("inf")
+            next_due = max(next_due, self.clock() + 1 / available)
+        return next_due
+
+    def due(self) -> bool:
+        """Whether any window should be classified now, for running rounds without
+        the background thread (see replay.py)"""
+        return len(self.due_ids()) > 0
+
+    def score_now(self) -> dict[int, float]:
+        """Classify windows that are due in one batch"""
+        win_ids = self.due_ids()
+        self.requested.clear()
+        if len(win_ids) == 0:
+            return {}
+
+        start = self.clock()
+        scores = self.classifier.classify_many(win_ids)
+        self.store(scores, start)
+        self.on_scores(scores)
+        return scores
+
+    def store(self, scores: dict[int, float], timestamp: float | None = None) -> None:
+        """Remember scores (including ones computed elsewhere, e.g. of the main
+        stream), from windows captured at timestamp (default now)"""
+        if timestamp is None:
+            timestamp = self.clock()
+        with self.lock:
+            for win_id, score in scores.items():
+                self.scores[win_id] = (score, timestamp)
+                self.samples.setdefault(win_id, deque()).append(timestamp)
+                if score >= COMMERCIAL_ENTER_THRESHOLD:
+                    self.last_commercial[win_id] = timestamp
+
+    def recent_scores(self, win_ids: list[int]) -> dict[int, float]:
+        """Return scores of the given windows that are at most max_age seconds old"""
+        now = self.clock()
+        with self.lock:
+            return {
+                win_id: self.scores[win_id][0]
+                for win_id in win_ids
+                if win_id in self.scores
+                and now - self.scores[win_id][1] <= self.max_age
+            }
+
+    def summary(self) -> str:
+        rates = self.sample_rates()
+        if len(rates) == 0:
+            return "No windows classified."
+        return "Classifications per minute: " + ", ".join(
+            f"{win_id}: {round(rate * 60, 1)}" for win_id, rate in rates.items()
+        )
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from capture import CaptureBackend, FileCaptureBackend, SyntheticCaptureBackend
+from classifier import IMAGE_DIMS
+from constants import DATA_DIRECTORY, FILE_EXTENSION, MODEL_FILE_PATH
+from ml_models.crop_screenshots import ImageCropper
+from model_backends import load_model
+
+"""
+Measure how long each stage of the commercial detection pipeline takes (capture, crop,
+resize, convert to array, predict) over a set of screenshots, and save the results as
+JSON to compare them across commits and model files. Runs headless (no yabai or browser
+needed): frames are read from image files, or generated if there aren't any.
+
+Run with python3 benchmark.py -f screenshots -m ml_models/part5_cropped_5-29-24.keras
+"""
+
+RESULTS_DIRECTORY = "benchmark_results"
+STAGES = ["capture", "crop", "crop_revalidate", "resize", "to_array", "predict"]
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def peak_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return max_rss / 1e6
+    return max_rss / 1e3
+
+
+def setup_capture(
+    fixtures_dir: str | None, num_frames: int
+) -> tuple[CaptureBackend, list[int]]:
+    """Return capture backend and window IDs to capture, one ID per fixture frame"""
+    paths = []
+    if fixtures_dir is not None and os.path.isdir(fixtures_dir):
+        for path, _, files in os.walk(fixtures_dir):
+            paths += [
+                os.path.join(path, f)
+                for f in sorted(files)
+                if f.endswith(f".{FILE_EXTENSION}")
+            ]
+
+    if len(paths) == 0:
+        print("No fixture screenshots found, using generated frames.")
+        return SyntheticCaptureBackend(), list(range(num_frames))
+
+    paths = paths[:num_frames]
+    return FileCaptureBackend(dict(enumerate(paths))), list(range(len(paths)))
+
+
+def run_pipeline(
+    capture_backend: CaptureBackend, win_id: int, model
+) -> dict[str, float]:
+    """Run each stage once on given window, mirroring Classifier, and return how long
+    each one took in seconds"""
+    timings = {}
+
+    start = time.perf_counter()
+    frame = capture_backend.capture(win_id)
+    timings["capture"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cropper = ImageCropper(frame)
+    try:
+        crop_points = cropper.get_crop_points(training=False, crop_left_right=True)
+        top, bottom, left, right = crop_points
+        img = cropper.img.crop((left, top, right, bottom))
+    except Exception:
+        crop_points = None
+        img = cropper.img
+    timings["crop"] = time.perf_counter() - start
+
+    if crop_points is not None:
+        # what the crop stage costs when crop points of previous frame are reused
+        start = time.perf_counter()
+        ImageCropper(frame).borders_unchanged(crop_points)
+        timings["crop_revalidate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    img = img.resize((IMAGE_DIMS[1], IMAGE_DIMS[0]))
+    timings["resize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    img_arr = np.asarray(img, dtype=np.float32)
+    timings["to_array"] = time.perf_counter() - start
+
+    if model is not None:
+        start = time.perf_counter()
+        model.predict(np.array([img_arr]))
+        timings["predict"] = time.perf_counter() - start
+
+    return timings
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    samples_ms = np.array(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(samples_ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+    }
+
+
+def print_results(results: dict, previous: dict | None = None) -> None:
+    print(f"\n{'stage':<16}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}", end="")
+    print("   p50 vs previous" if previous is not None else "")
+    for stage, stats in results["stages"].items():
+        line = f"{stage:<16}"
+        line += "".join(f"{stats[key]:>10}" for key in ["p50_ms", "p95_ms", "p99_ms"])
+        if previous is not None and stage in previous["stages"]:
+            before = previous["stages"][stage]["p50_ms"]
+            if before > 0:
+                line += f"   {round((stats['p50_ms'] / before - 1) * 100, 1):+}%"
+        print(line)
+
+    print(f"\nThroughput: {results['throughput_fps']} frames/s")
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the commercial detection pipeline"
+    )
+    parser.add_argument(
+        "-f",
+        "--fixtures",
+        default=DATA_DIRECTORY,
+        help="Directory of screenshots to run pipeline on (generated frames if none)",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        default=MODEL_FILE_PATH,
+        help="Path to classifier .keras or .tflite file (predict stage is skipped if"
+        " it doesn't exist)",
+    )
+    parser.add_argument("-n", "--num-frames", type=int, default=50)
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Number of passes over frames"
+    )
+    parser.add_argument(
+        "-w", "--warmup", type=int, default=3, help="Frames to run before measuring"
+    )
+    parser.add_argument("-o", "--output", help="Path of JSON results file")
+    parser.add_argument(
+        "-c", "--compare", help="Path of previous JSON results file to compare to"
+    )
+    args = parser.parse_args()
+
+    capture_backend, win_ids = setup_capture(args.fixtures, args.num_frames)
+
+    model = None
+    if os.path.exists(args.model):
+        load_start = time.perf_counter()
+        model = load_model(args.model)
+        print(f"Loaded {args.model} in {round(time.perf_counter() - load_start, 2)}s.")
+    else:
+        print(f"{args.model} not found, skipping predict stage.")
+
+    for win_id in win_ids[: args.warmup]:
+        run_pipeline(capture_backend, win_id, model)
+
+    stage_samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for win_id in win_ids:
+            for stage, duration in run_pipeline(capture_backend, win_id, model).items():
+                stage_samples[stage].append(duration)
+    total_time = time.perf_counter() - start
+    num_runs = args.repeat * len(win_ids)
+
+    commit = get_commit()
+    results = {
+        "commit": commit,
+        "model": args.model if model is not None else None,
+        "fixtures": (
+            args.fixtures if isinstance(capture_backend, FileCaptureBackend) else None
+        ),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "num_frames": num_runs,
+        "stages": {
+            stage: summarize(samples)
+            for stage, samples in stage_samples.items()
+            if len(samples) > 0
+        },
+        # crop_revalidate is an alternative to crop, so don't count it
+        "throughput_fps": round(
+            num_runs / (total_time - sum(stage_samples["crop_revalidate"])), 2
+        ),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    if args.output is None:
+        model_name = "no_model"
+        if model is not None:
+            model_name = os.path.splitext(os.path.basename(args.model))[0]
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        args.output = os.path.join(
+            RESULTS_DIRECTORY,
+            f"{datetime.now().strftime('%y-%m-%d_%H-%M-%S')}_{commit}_{model_name}.json",
+        )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import itertools
+import json
+import urllib.request
+from threading import Lock
+
+import tracing
+from constants import BROWSER_DEBUGGING_PORT
+from utils import (
+    PAGE_CONTROLLER_MISSING,
+    call_page_controller,
+    load_script,
+    page_controller_call,
+    run_shell,
+    strip_win_title,
+)
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+"""
+Run JavaScript in stream tabs over persistent DevTools protocol connections (one per
+tab, kept open for the whole session) instead of launching a brave-cli process for
+every call. Needs Brave to be started with --remote-debugging-port (see README), and
+falls back to brave-cli for tabs it can't reach.
+"""
+
+
+class DevToolsChannel:
+    """Persistent DevTools protocol connection to one tab"""
+
+    def __init__(self, ws_url: str, timeout: float = 2) -> None:
+        self.ws_url = ws_url
+        self.timeout = timeout
+        self.message_ids = itertools.count(1)
+        self.lock = Lock()
+        self.connection = None
+
+    def connect(self) -> None:
+        self.close()
+        # browsers reject DevTools connections with an Origin header unless started
+        # with --remote-allow-origins
+        self.connection = websocket.create_connection(
+            self.ws_url, timeout=self.timeout, suppress_origin=True
+        )
+
+    def close(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def _evaluate_once(self, expression: str) -> str:
+        if self.connection is None:
+            self.connect()
+
+        message_id = next(self.message_ids)
+        self.connection.send(
+            json.dumps(
+                {
+                    "id": message_id,
+                    "method": "Runtime.evaluate",
+                    "params": {"expression": expression, "returnByValue": True},
+                }
+            )
+        )
+        while True:
+            response = json.loads(self.connection.recv())
+            # skip events and responses to earlier requests that timed out
+            if response.get("id") == message_id:
+                break
+
+        if "error" in response:
+            raise Exception(f"DevTools error: {response['error']}")
+        result = response["result"]
+        if "exceptionDetails" in result:
+            raise Exception(
+                f"JavaScript error: {result['exceptionDetails'].get('text')}"
+            )
+        value = result["result"].get("value")
+        # match what brave-cli prints
+        return "" if value is None else str(value)
+
+    def evaluate(self, expression: str) -> str:
+        """Run expression in tab and return its value as a string, reconnecting once
+        if the connection was lost"""
+        with self.lock:
+            try:
+                return self._evaluate_once(expression)
+            except (OSError, websocket.WebSocketException):
+                self.connect()
+                return self._evaluate_once(expression)
+
+
+class BrowserController:
+    """Runs the scripts in javascript/ in stream tabs, over DevTools connections when
+    possible and with brave-cli otherwise"""
+
+    def __init__(
+        self, id_dict: dict[int, int], port: int | None = BROWSER_DEBUGGING_PORT
+    ) -> None:
+        """id_dict maps yabai window IDs to brave-cli tab IDs. Pass port=None to always
+        use brave-cli."""
+        self.id_dict = id_dict
+        self.port = port
+        # keys: yabai window IDs
+        self.channels: dict[int, DevToolsChannel] = {}
+        if port is not None:
+            self.connect_channels()
+
+    def connect_channels(self) -> None:
+        """Find DevTools target of each stream tab (by URL, then by title) and open a
+        connection to it"""
+        if websocket is None:
+            print("websocket-client not installed, controlling tabs with brave-cli.")
+            return
+
+        try:
+            with urllib.request.urlopen(
+                f"http://localhost:{self.port}/json/list", timeout=1
+            ) as response:
+                targets = [
+                    target
+                    for target in json.load(response)
+                    if target.get("type") == "page" and "webSocketDebuggerUrl" in target
+                ]
+        except OSError:
+            print(
+                f"No browser DevTools endpoint on port {self.port}, controlling tabs"
+                " with brave-cli."
+            )
+            return
+
+        tabs = json.loads(
+            run_shell("OUTPUT_FORMAT=json brave-cli list tabs", shell=True)
+        )
+        tabs_by_id = {int(tab["id"]): tab for tab in tabs["tabs"]}
+        for win_id, chrome_cli_id in self.id_dict.items():
+            tab = tabs_by_id.get(chrome_cli_id)
+            if tab is None:
+                continue
+            matches = [t for t in targets if t["url"] == tab["url"]]
+            if len(matches) != 1:
+                matches = [
+                    t
+                    for t in targets
+                    if strip_win_title(t["title"]) == strip_win_title(tab["windowName"])
+                ]
+            if len(matches) == 1:
+                channel = DevToolsChannel(matches[0]["webSocketDebuggerUrl"])
+                try:
+                    channel.connect()
+                except (OSError, websocket.WebSocketException) as e:
+                    print(f"Unable to connect to DevTools of window {win_id}: {e}")
+                    continue
+                self.channels[win_id] = channel
+
+        print(
+            f"Controlling {len(self.channels)}/{len(self.id_dict)} tabs over DevTools"
+            " connections."
+        )
+
+    def close(self) -> None:
+        for channel in self.channels.values():
+            channel.close()
+        self.channels.clear()
+
+    def call(self, win_id: int, method: str) -> str:
+        """Call method of the controller injected by javascript/controller.js in
+        window's tab (injecting it first if the page doesn't have it yet), so that only
+        a tiny expression is sent each time"""
+        channel = self.channels.get(win_id)
+        if channel is not None:
+            try:
+                result = channel.evaluate(page_controller_call(method))
+                if result == PAGE_CONTROLLER_MISSING:
+                    channel.evaluate(load_script("javascript/controller.js"))
+                    result = channel.evaluate(page_controller_call(method))
+                return result
+            except Exception as e:
+                print(f"DevTools call to window {win_id} failed, using brave-cli: {e}")
+
+        return call_page_controller(self.id_dict[win_id], method)
+
+    @tracing.traced("control_stream_audio")
+    def set_muted(self, win_id: int, mute: bool = True) -> None:
+        self.call(win_id, "mute" if mute else "unmute")
@@ -0,0 +1,151 @@
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+from PIL import Image
+
+from utils import take_screenshot
+
+try:
+    import Quartz
+except ImportError:
+    # only available on macOS with pyobjc-framework-Quartz installed
+    Quartz = None
+
+
+class CaptureBackend(ABC):
+    """Grabs the current contents of a window as a PIL image. Classifier only talks to
+    this interface, so frames can come from the screen, from files on disk, or be
+    generated (useful for running the pipeline on Linux without yabai or a browser)
+    """
+
+    @abstractmethod
+    def capture(self, win_id: int) -> Image.Image:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class QuartzCaptureBackend(CaptureBackend):
+    """Capture windows straight into memory with CoreGraphics. Produces the same image
+    as screencapture -oxl, but skips writing a JPEG to disk and decoding it again.
+    """
+
+    def __init__(self) -> None:
+        if Quartz is None:
+            raise Exception(
+                "QuartzCaptureBackend requires pyobjc-framework-Quartz (macOS only)"
+            )
+
+    def capture(self, win_id: int) -> Image.Image:
+        cg_image = Quartz.CGWindowListCreateImage(
+            Quartz.CGRectNull,
+            Quartz.kCGWindowListOptionIncludingWindow,
+            win_id,
+            # same as -o flag of screencapture (don't include window shadow)
+            Quartz.kCGWindowImageBoundsIgnoreFraming,
+        )
+        if cg_image is None:
+            raise Exception(f"Unable to capture window with ID {win_id}")
+
+        width = Quartz.CGImageGetWidth(cg_image)
+        height = Quartz.CGImageGetHeight(cg_image)
+        bytes_per_row = Quartz.CGImageGetBytesPerRow(cg_image)
+        data = Quartz.CGDataProviderCopyData(Quartz.CGImageGetDataProvider(cg_image))
+        img = Image.frombuffer(
+            "RGBA", (width, height), data, "raw", "BGRA", bytes_per_row, 1
+        )
+
+        return img.convert("RGB")
+
+
+class ScreencaptureBackend(CaptureBackend):
+    """Fallback that shells out to screencapture and reads the image back from a temp
+    file. Slower than QuartzCaptureBackend, but doesn't need pyobjc.
+    """
+
+    def __init__(self, screenshot_tempfile: str = "nbaredzone_screenshot.jpg") -> None:
+        self.screenshot_tempfile = screenshot_tempfile
+
+    def capture(self, win_id: int) -> Image.Image:
+        take_screenshot(win_id, self.screenshot_tempfile)
+        with Image.open(self.screenshot_tempfile) as img:
+            img.load()
+        return img
+
+    def close(self) -> None:
+        try:
+            os.remove(self.screenshot_tempfile)
+            print("Screenshot temp image file removed.")
+        except FileNotFoundError:
+            pass
+
+
+class FileCaptureBackend(CaptureBackend):
+    """Serve frames for each window from image files on disk (e.g. screenshots taken
+    by ScreenshotTaker). Call set_frame to change which file a window shows.
+    """
+
+    def __init__(self, frame_paths: dict[int, str] = {}) -> None:
+        self.frame_paths = dict(frame_paths)
+
+    def set_frame(self, win_id: int, file_path: str) -> None:
+        self.frame_paths[win_id] = file_path
+
+    def capture(self, win_id: int) -> Image.Image:
+        try:
+            file_path = self.frame_paths[win_id]
+        except KeyError:
+            raise Exception(f"No frame file set for window with ID {win_id}")
+
+        with Image.open(file_path) as img:
+            img.load()
+        return img
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    """Generate frames that look like a stream in a minimal Brave window: a window
+    header, a one-color background around the stream, and noise where the stream
+    is. Lets the capture/crop/classify pipeline run without a screen.
+    """
+
+    HEADER_COLOR = (40, 40, 40)
+    BACKGROUND_COLOR = (31, 31, 31)
+
+    def __init__(
+        self,
+        size: tuple[int, int] = (1440, 900),
+        stream_box: tuple[int, int, int, int] | None = None,
+        seed: int = 0,
+    ) -> None:
+        """NOTE: size is of the form (width, height), and stream_box of the form
+        (top, bottom, left, right) like ImageCropper.get_crop_points returns.
+        """
+        self.size = size
+        width, height = size
+        if stream_box is None:
+            stream_height = (width * 9) // 16
+            top = (height - stream_height) // 2
+            stream_box = (top, top + stream_height, 0, width)
+        self.stream_box = stream_box
+        self.rng = np.random.default_rng(seed)
+
+    def capture(self, win_id: int) -> Image.Image:
+        width, height = self.size
+        top, bottom, left, right = self.stream_box
+
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:, :] = self.BACKGROUND_COLOR
+        frame[:56, :] = self.HEADER_COLOR
+        frame[top:bottom, left:right] = self.rng.integers(
+            0, 256, (bottom - top, right - left, 3), dtype=np.uint8
+        )
+
+        return Image.fromarray(frame)
+
+
+def default_capture_backend() -> CaptureBackend:
+    if Quartz is not None:
+        return QuartzCaptureBackend()
+    return ScreencaptureBackend()
@@ -1,62 +1,311 @@
-import os
 import time
+from threading import Event, Lock, Thread
+from typing import Callable
 
-print("Importing Python machine learning libraries, this may take a few seconds...")
-
-import keras
 import numpy as np
-from keras.api.preprocessing.image import img_to_array
+from PIL import Image
 
+import metrics
+import tracing
+from capture import CaptureBackend, default_capture_backend
+from constants import (
+    COMMERCIAL_ENTER_THRESHOLD,
+    FRAME_REUSE_MAX_AGE,
+    FRAME_SIMILARITY_THRESHOLD,
+    SCORE_CALIBRATION,
+)
 from ml_models.crop_screenshots import ImageCropper
-from utils import take_screenshot
+from model_backends import KerasModel, TFLiteModel, load_model
 
 # TODO: deal with this being in multiple places
 IMAGE_DIMS = (200, 320)
 
 
+def commercial_probability(
+    model_output: np.ndarray, calibration: tuple[float, float]
+) -> np.ndarray:
+    """Convert model output (close to 0 for commercials and close to 1 for NBA games)
+    to probability of showing a commercial, calibrated with Platt scaling parameters
+    fitted by ml_models/calibrate.py"""
+    slope, intercept = calibration
+    commercial_output = np.clip(1 - model_output, 1e-7, 1 - 1e-7)
+    logit = np.log(commercial_output / (1 - commercial_output))
+    return 1 / (1 + np.exp(-(slope * logit + intercept)))
+
+
+class FrameCache:
+    """Remembers the last frame of each window that was passed to the model, along
+    with the score the model gave it. Consecutive frames during play or during one
+    long commercial often look almost the same, so their score can be reused instead
+    of running the model again.
+    """
+
+    # side length of the blocks of pixels averaged together to compare frames
+    THUMBNAIL_BLOCK = 10
+
+    def __init__(
+        self,
+        max_distance: float = FRAME_SIMILARITY_THRESHOLD,
+        max_age: float = FRAME_REUSE_MAX_AGE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """max_distance is the largest mean difference (0-255) between grayscale
+        thumbnails of two frames for them to count as the same. A score is reused for
+        at most max_age seconds after the model computed it.
+        """
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.clock = clock
+        # windows are classified from more than one thread
+        self.lock = Lock()
+        # keys: window IDs, values: thumbnail of last frame passed to model, time when
+        # it was, and the score the model gave it
+        self.entries: dict[int, tuple[np.ndarray, float, float]] = {}
+        self.hits: dict[int, int] = {}
+        self.misses: dict[int, int] = {}
+
+    def thumbnail(self, img_arr: np.ndarray) -> np.ndarray:
+        block = self.THUMBNAIL_BLOCK
+        height = (img_arr.shape[0] // block) * block
+        width = (img_arr.shape[1] // block) * block
+        gray = img_arr[:height, :width].mean(axis=2)
+        return gray.reshape(height // block, block, width // block, block).mean(
+            axis=(1, 3)
+        )
+
+    def lookup(self, win_id: int, img_arr: np.ndarray) -> float | None:
+        """Return previous score of window if given model input looks the same as the
+        last one the model saw, otherwise None"""
+        with self.lock:
+            entry = self.entries.get(win_id)
+        if entry is not None:
+            thumbnail, timestamp, score = entry
+            distance = np.abs(self.thumbnail(img_arr) - thumbnail).mean()
+            if (
+                distance <= self.max_distance
+                and self.clock() - timestamp <= self.max_age
+            ):
+                with self.lock:
+                    self.hits[win_id] = self.hits.get(win_id, 0) + 1
+                return score
+
+        with self.lock:
+            self.misses[win_id] = self.misses.get(win_id, 0) + 1
+        return None
+
+    def store(self, win_id: int, img_arr: np.ndarray, score: float) -> None:
+        thumbnail = self.thumbnail(img_arr)
+        with self.lock:
+            self.entries[win_id] = (thumbnail, self.clock(), score)
+
+    def summary(self) -> str:
+        with self.lock:
+            total_hits = sum(self.hits.values())
+            total = total_hits + sum(self.misses.values())
+        if total == 0:
+            return "No frames classified."
+        return (
+            f"Reused previous score for {total_hits}/{total} frames"
+            f" ({round(total_hits / total * 100, 2)}%), skipping that many model runs."
+        )
+
+
 class Classifier:
     def __init__(
         self,
         model_file_path: str,
-        screenshot_tempfile: str = "nbaredzone_screenshot.jpg",
+        capture_backend: CaptureBackend | None = None,
+        frame_cache: FrameCache | None = None,
+        load_in_background: bool = False,
+        calibration: tuple[float, float] = SCORE_CALIBRATION,
     ) -> None:
-        self.screenshot_tempfile = screenshot_tempfile
+        """If load_in_background is True, the model is loaded in a background thread
+        so that setup can continue in the meantime. Classifying waits until it's done.
+        """
+        if capture_backend is None:
+            capture_backend = default_capture_backend()
+        self.capture_backend = capture_backend
+        if frame_cache is None:
+            frame_cache = FrameCache()
+        self.frame_cache = frame_cache
         self.model_file_path = model_file_path
-        self.model = keras.models.load_model(self.model_file_path)
+        self.calibration = calibration
+        self.model: KerasModel | TFLiteModel | None = None
+        self.model_error: Exception | None = None
+        self.model_ready = Event()
+        # windows are classified from more than one thread (main loop, BackgroundScorer
+        # and window actions), but capture backends and models can only do one at a
+        # time
+        self.capture_lock = Lock()
+        self.predict_lock = Lock()
+        self.crop_points_lock = Lock()
+        if load_in_background:
+            Thread(target=self._load_model, daemon=True).start()
+        else:
+            self._load_model()
+            self.wait_until_ready()
+        # keys: window IDs, values: window size and crop points of last screenshot
+        self.crop_points: dict[
+            int, tuple[tuple[int, int], tuple[int, int, int, int]]
+        ] = {}
 
     def __del__(self) -> None:
+        if hasattr(self, "capture_backend"):
+            self.capture_backend.close()
+
+    def _load_model(self) -> None:
         try:
-            os.remove(self.screenshot_tempfile)
-            print("Screenshot temp image file removed.")
-        except FileNotFoundError:
-            pass
+            start = time.time()
+            # .keras files are run with Keras, .tflite files without importing
+            # TensorFlow
+            model = load_model(self.model_file_path)
+            # the first prediction is much slower than the rest (e.g. Keras traces the
+            # model), so get it out of the way on a dummy input
+            model.predict(np.zeros((1, *IMAGE_DIMS, 3), dtype=np.float32))
+            self.model = model
+            print(
+                f"Classifier loaded and warmed up in {round(time.time() - start, 2)}s."
+            )
+        except Exception as e:
+            self.model_error = e
+        finally:
+            self.model_ready.set()
 
-    def classify(self, win_id: int, double_check_commercials: bool = True) -> bool:
-        """Return whether window with given ID is displaying a commercial"""
-        start = time.time()
-        take_screenshot(win_id, self.screenshot_tempfile)
-        before_classify = time.time()
-        cropper = ImageCropper(self.screenshot_tempfile)
+    def wait_until_ready(self) -> None:
+        """Block until model is loaded and warmed up"""
+        self.model_ready.wait()
+        if self.model_error is not None:
+            raise Exception(
+                f"Unable to load classifier {self.model_file_path}"
+            ) from self.model_error
+
+    def get_crop_points(
+        self, win_id: int | None, cropper: ImageCropper
+    ) -> tuple[int, int, int, int]:
+        """Return crop points of window's stream, reusing the ones found in the
+        window's last screenshot if the window is the same size and its borders still
+        look the same. The stream rarely moves within its window, so this skips
+        finding the edges on almost every tick.
+        """
+        with self.crop_points_lock:
+            previous = self.crop_points.get(win_id)
+        if previous is not None:
+            size, crop_points = previous
+            if size == cropper.img.size and cropper.borders_unchanged(crop_points):
+                return crop_points
+
+        crop_points = cropper.get_crop_points(training=False, crop_left_right=True)
+        if win_id is not None:
+            with self.crop_points_lock:
+                self.crop_points[win_id] = (cropper.img.size, crop_points)
+
+        return crop_points
+
+    def invalidate_crop_points(self, win_id: int | None = None) -> None:
+        """Find crop points from scratch next time given window (or all windows if
+        None) is classified, e.g. because it was resized"""
+        with self.crop_points_lock:
+            if win_id is None:
+                self.crop_points.clear()
+            else:
+                self.crop_points.pop(win_id, None)
+
+    def preprocess(self, frame: Image.Image, win_id: int | None = None) -> np.ndarray:
+        """Crop and resize captured frame and return it as an array to pass to the
+        model"""
+        cropper = ImageCropper(frame)
         try:
-            img = cropper.crop_image(resize_dims=(IMAGE_DIMS[1], IMAGE_DIMS[0]))
+            crop_points = self.get_crop_points(win_id, cropper)
+            img = cropper.crop_image(
+                resize_dims=(IMAGE_DIMS[1], IMAGE_DIMS[0]), crop_points=crop_points
+            )
         except Exception as e:
             print(e)
+            self.invalidate_crop_points(win_id)
             # use uncropped image as input if error cropping
             img = cropper.img.resize((IMAGE_DIMS[1], IMAGE_DIMS[0]))
 
-        img_arr = img_to_array(img)
-        img_arr = np.array([img_arr])
-        prediction = self.model.predict(img_arr, verbose=0)
+        return np.asarray(img, dtype=np.float32)
+
+    def _score_windows(
+        self, win_ids: list[int], use_cache: bool = True
+    ) -> tuple[dict[int, float], str]:
+        """Return scores (probability of showing a commercial) of given windows along
+        with a string describing how long it took. Unless use_cache is False, windows
+        whose frame barely changed since it was last passed to the model reuse that
+        score, and the rest are passed to the model as one batch.
+        """
+        start = time.time()
+        frames = []
+        for win_id in win_ids:
+            with tracing.span("take_screenshot", win_id=win_id), self.capture_lock:
+                frames.append(self.capture_backend.capture(win_id))
+        before_classify = time.time()
+
+        scores: dict[int, float] = {}
+        model_inputs: dict[int, np.ndarray] = {}
+        for win_id, frame in zip(win_ids, frames):
+            with tracing.span("crop", win_id=win_id):
+                img_arr = self.preprocess(frame, win_id)
+            cached_score = None
+            if use_cache:
+                cached_score = self.frame_cache.lookup(win_id, img_arr)
+            if cached_score is None:
+                model_inputs[win_id] = img_arr
+            else:
+                scores[win_id] = cached_score
+                metrics.reused_scores.inc(window=win_id)
+        before_predict = time.time()
+
+        if len(model_inputs) > 0:
+            self.wait_until_ready()
+            with tracing.span("predict", win_ids=list(model_inputs)), self.predict_lock:
+                model_output = self.model.predict(np.array(list(model_inputs.values())))
+            predictions = commercial_probability(model_output[:, 0], self.calibration)
+            for (win_id, img_arr), prediction in zip(model_inputs.items(), predictions):
+                scores[win_id] = float(prediction)
+                self.frame_cache.store(win_id, img_arr, scores[win_id])
+                metrics.inferences.inc(window=win_id)
         done = time.time()
+
+        metrics.classify_seconds.observe(before_classify - start, stage="capture")
+        metrics.classify_seconds.observe(
+            before_predict - before_classify, stage="preprocess"
+        )
+        if len(model_inputs) > 0:
+            metrics.classify_seconds.observe(done - before_predict, stage="predict")
+        metrics.classify_seconds.observe(done - start, stage="total")
+
         res_str = f"{round(before_classify - start, 2)}s to take sc, {round(done - before_classify, 2)} to classify"
+        num_reused = len(win_ids) - len(model_inputs)
+        if num_reused > 0:
+            res_str += f" (reused {num_reused} previous score(s))"
+
+        return {win_id: scores[win_id] for win_id in win_ids}, res_str
+
+    def classify(self, win_id: int, use_cache: bool = True) -> float:
+        """Return probability that window with given ID is displaying a commercial. Set
+        use_cache to False to always run the model, e.g. when the score has to be
+        independent of the previous one"""
+        scores, res_str = self._score_windows([win_id], use_cache)
+        score = scores[win_id]
 
-        if prediction[0][0] <= 0.5:
-            print(f"looks like commercial. {res_str}")
-            if double_check_commercials:
-                print("Double checking:")
-                time.sleep(3)
-                return self.classify(win_id, False)
-            return True
+        if score >= COMMERCIAL_ENTER_THRESHOLD:
+            print(f"looks like commercial ({round(score, 3)}). {res_str}")
         else:
-            print(f"looks like NBA. {res_str}")
-            return False
+            print(f"looks like NBA ({round(score, 3)}). {res_str}")
+
+        return score
+
+    def classify_many(self, win_ids: list[int]) -> dict[int, float]:
+        """Return dictionary mapping each given window ID to the probability that it is
+        displaying a commercial. All windows are passed to the model as one batch, so
+        this is much faster than calling classify on each one.
+        """
+        if len(win_ids) == 0:
+            return {}
+
+        scores, res_str = self._score_windows(win_ids)
+        print(f"{len(win_ids)} windows: {res_str}")
+
+        return scores
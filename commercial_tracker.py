@@ -0,0 +1,74 @@
+from constants import (
+    COMMERCIAL_CONFIRM_FRAMES,
+    COMMERCIAL_ENTER_THRESHOLD,
+    COMMERCIAL_EXIT_THRESHOLD,
+    CONFIDENT_COMMERCIAL_SCORE,
+    CONFIDENT_GAME_SCORE,
+    GAME_CONFIRM_FRAMES,
+)
+
+
+class CommercialTracker:
+    """Decides when a window switches between showing a game and a commercial based on
+    its scores on consecutive ticks, so that one misclassified frame doesn't cause a
+    switch. Replaces sleeping and classifying again to double check, which blocked
+    the main loop. Confident scores switch right away, so extra frames are only spent
+    on ambiguous ones.
+    """
+
+    def __init__(
+        self,
+        commercial_frames: int = COMMERCIAL_CONFIRM_FRAMES,
+        game_frames: int = GAME_CONFIRM_FRAMES,
+        enter_threshold: float = COMMERCIAL_ENTER_THRESHOLD,
+        exit_threshold: float = COMMERCIAL_EXIT_THRESHOLD,
+        confident_commercial: float = CONFIDENT_COMMERCIAL_SCORE,
+        confident_game: float = CONFIDENT_GAME_SCORE,
+    ) -> None:
+        """commercial_frames is the number of consecutive frames that must score at
+        least enter_threshold to go from game to commercial, and game_frames the
+        number that must score below exit_threshold to go back
+        """
+        self.commercial_frames = commercial_frames
+        self.game_frames = game_frames
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.confident_commercial = confident_commercial
+        self.confident_game = confident_game
+        # number of consecutive frames that disagreed with counted_against
+        self.streak = 0
+        self.counted_against: bool | None = None
+
+    def update(self, was_commercial: bool, score: float) -> bool:
+        """Add score of newest frame and return whether window should now be considered
+        to be showing a commercial"""
+        if was_commercial:
+            disagrees = score < self.exit_threshold
+            confident = score <= self.confident_game
+            needed_frames = self.game_frames
+        else:
+            disagrees = score >= self.enter_threshold
+            confident = score >= self.confident_commercial
+            needed_frames = self.commercial_frames
+
+        if not disagrees:
+            self.streak = 0
+            return was_commercial
+
+        # state can be changed from elsewhere (e.g. forcing commercial from remote), so
+        # only keep counting if streak was counted against the same state
+        if self.counted_against != was_commercial:
+            self.counted_against = was_commercial
+            self.streak = 0
+        self.streak += 1
+
+        if confident or self.streak >= needed_frames:
+            self.streak = 0
+            return not was_commercial
+        return was_commercial
+
+    @property
+    def pending(self) -> bool:
+        """Whether latest frames disagree with the current state, but not yet for long
+        enough to change it"""
+        return self.streak > 0
@@ -2,8 +2,80 @@
 MODEL_FILE_PATH = "ml_models/part5_cropped_5-29-24.keras"
 DEFAULT_PORT = 80
 DEFAULT_UPDATE_RATE = 3
+# port of Brave's DevTools endpoint, used to run JavaScript in tabs without launching
+# brave-cli each time
+BROWSER_DEBUGGING_PORT = 9222
+# classifier scores frames with the probability that they show a commercial. Frames
+# scoring >= COMMERCIAL_ENTER_THRESHOLD look like a commercial while a window shows a
+# game, and frames scoring < COMMERCIAL_EXIT_THRESHOLD look like a game while it shows
+# a commercial. Run ml_models/calibrate.py to fit these (and SCORE_CALIBRATION) on
+# validation data
+COMMERCIAL_ENTER_THRESHOLD = 0.5
+COMMERCIAL_EXIT_THRESHOLD = 0.5
+SCORE_CALIBRATION = (1.0, 0.0)
+# number of consecutive frames that must look like a commercial/game to switch away
+# from/back to main window, unless a frame scores at least CONFIDENT_COMMERCIAL_SCORE
+# or at most CONFIDENT_GAME_SCORE, in which case it switches right away
+COMMERCIAL_CONFIRM_FRAMES = 2
+GAME_CONFIRM_FRAMES = 1
+CONFIDENT_COMMERCIAL_SCORE = 0.99
+CONFIDENT_GAME_SCORE = 0.01
+# check main window again after this many seconds instead of DEFAULT_UPDATE_RATE when
+# waiting to confirm a switch
+CONFIRM_UPDATE_RATE = 1
+# classify at most this many frames per second across all windows. What isn't used
+# by checking the main window is used to classify the other windows in the background,
+# so that switching away from the main stream can use their recent scores instead of
+# classifying them first
+INFERENCE_BUDGET = 1.5
+# share of the background classifications each window gets, relative to other windows:
+# the window that would be switched to next, windows that showed a commercial within
+# RECENT_COMMERCIAL_SECONDS, and all others (weight 1)
+NEXT_TARGET_WEIGHT = 4
+RECENT_COMMERCIAL_WEIGHT = 2
+RECENT_COMMERCIAL_SECONDS = 120
+# classify a window in the background at most this often, no matter how much budget
+# is left, and don't switch to it based on scores older than BACKGROUND_SCORE_MAX_AGE
+BACKGROUND_SCORE_MIN_INTERVAL = 2
+BACKGROUND_SCORE_MAX_AGE = 12
+# report classifications per second of each window averaged over this many seconds
+SAMPLE_RATE_WINDOW = 60
 # when making request to start halftime, stop classification for 15 minutes
 HALFTIME_DURATION = 15 * 60
+# send a comment over each remote's state stream after this many seconds without
+# changes, so that the connection isn't closed for being idle
+STATE_STREAM_HEARTBEAT = 15
+# don't switch to a window for this many seconds when it's snoozed from the remote,
+# unless another duration is given
+SNOOZE_DURATION = 30 * 60
+# yabai signals arriving less than this many seconds apart count as one burst and are
+# handled together (bursts end after SIGNAL_MAX_DELAY seconds at the latest)
+SIGNAL_QUIET_SECONDS = 0.25
+SIGNAL_MAX_DELAY = 1
+# ignore resize signals for this many seconds after toggling fullscreen, since
+# toggling resizes the windows too
+RESIZE_SETTLE_SECONDS = 1
+# query yabai for the state of all windows this often to catch changes that signals
+# didn't report
+WINDOW_RECONCILE_INTERVAL = 10
+# number of threads running independent window actions (e.g. muting several windows)
+# at the same time
+ACTUATOR_WORKERS = 4
+# treat yabai focus signals for a window as caused by this program for this many
+# seconds after it focused the window (signals can arrive before the switch is done)
+SELF_FOCUS_MAX_AGE = 5
+# don't mute/unmute a window if it was already muted/unmuted within this many seconds
+# (after that, send the command again in case the page reloaded and lost its state)
+AUDIO_STATE_MAX_AGE = 60
+# reuse previous classification of a window if its new screenshot differs from the
+# last classified one by at most this much on average (0-255), for up to
+# FRAME_REUSE_MAX_AGE seconds
+FRAME_SIMILARITY_THRESHOLD = 4
+FRAME_REUSE_MAX_AGE = 15
+# rotate trace file (see tracing.py) once it reaches this size, keeping this many old
+# files
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUP_COUNT = 3
 
 # for take_screenshots.py
 FILE_EXTENSION = "jpg"
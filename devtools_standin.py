@@ -0,0 +1,212 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Callable
+
+import numpy as np
+
+"""
+Local stand-in for a browser's DevTools endpoint, to try browser_control.py without
+Brave: serves /json/list with fake page targets and answers Runtime.evaluate over
+WebSocket with whatever responder returns (the JavaScript isn't actually run).
+
+Run with python3 devtools_standin.py to time mute calls over persistent connections
+and check that they reconnect after the connection drops.
+"""
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def read_frame(sock: socket.socket) -> tuple[int, bytes]:
+    """Return opcode and payload of next WebSocket frame sent by client"""
+
+    def read_exactly(num_bytes: int) -> bytes:
+        data = b""
+        while len(data) < num_bytes:
+            chunk = sock.recv(num_bytes - len(data))
+            if chunk == b"":
+                raise ConnectionError("Client closed connection")
+            data += chunk
+        return data
+
+    first, second = read_exactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack(">H", read_exactly(2))[0]
+    elif length == 127:
+        length = struct.unpack(">Q", read_exactly(8))[0]
+    # frames from clients are always masked
+    mask = read_exactly(4)
+    payload = bytearray(read_exactly(length))
+    for index in range(length):
+        payload[index] ^= mask[index % 4]
+    return first & 0x0F, bytes(payload)
+
+
+def write_frame(sock: socket.socket, opcode: int, payload: bytes) -> None:
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 2**16:
+        header += bytes([126]) + struct.pack(">H", len(payload))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(payload))
+    sock.sendall(header + payload)
+
+
+class StandInDevToolsServer:
+    def __init__(
+        self,
+        targets: list[dict],
+        responder: Callable[[str, str], Any] = lambda target_id, expression: None,
+        port: int = 0,
+    ) -> None:
+        """targets are dicts with id, title and url keys. responder is called with
+        target ID and expression of each Runtime.evaluate request, and its return value
+        is sent back as the result. Port 0 picks a free port."""
+        self.targets = targets
+        self.responder = responder
+        # keys: target IDs, values: expressions evaluated in that target
+        self.expressions: dict[str, list[str]] = {t["id"]: [] for t in targets}
+        self.open_sockets: list[socket.socket] = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self) -> None:
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.drop_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def drop_connections(self) -> None:
+        """Close all WebSocket connections, like a browser tab crashing or reloading"""
+        for sock in self.open_sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.open_sockets.clear()
+
+    def _handler_class(self) -> type:
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") in ["/json", "/json/list"]:
+                    body = json.dumps(
+                        [
+                            {
+                                **target,
+                                "type": "page",
+                                "webSocketDebuggerUrl": f"ws://127.0.0.1:{standin.port}"
+                                f"/devtools/page/{target['id']}",
+                            }
+                            for target in standin.targets
+                        ]
+                    ).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path.startswith("/devtools/page/"):
+                    self.handle_websocket(self.path.rsplit("/", 1)[1])
+                else:
+                    self.send_error(404)
+
+            def handle_websocket(self, target_id: str) -> None:
+                if target_id not in standin.expressions:
+                    self.send_error(404)
+                    return
+                key = self.headers["Sec-WebSocket-Key"]
+                accept = base64.b64encode(
+                    hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+                ).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+
+                sock = self.connection
+                standin.open_sockets.append(sock)
+                try:
+                    while True:
+                        opcode, payload = read_frame(sock)
+                        if opcode == 8:
+                            write_frame(sock, 8, b"")
+                            break
+                        if opcode != 1:
+                            continue
+                        request = json.loads(payload)
+                        expression = request["params"]["expression"]
+                        standin.expressions[target_id].append(expression)
+                        value = standin.responder(target_id, expression)
+                        result = {"type": "undefined"}
+                        if value is not None:
+                            result = {"type": type(value).__name__, "value": value}
+                        response = {"id": request["id"], "result": {"result": result}}
+                        write_frame(sock, 1, json.dumps(response).encode())
+                except (ConnectionError, OSError):
+                    pass
+                self.close_connection = True
+
+        return Handler
+
+
+def main() -> None:
+    from browser_control import DevToolsChannel
+    from utils import page_controller_call
+
+    targets = [
+        {"id": f"TARGET{i}", "title": f"Stream {i}", "url": f"https://example.com/{i}"}
+        for i in range(4)
+    ]
+    standin = StandInDevToolsServer(targets)
+    standin.start()
+
+    channels = [
+        DevToolsChannel(f"ws://127.0.0.1:{standin.port}/devtools/page/{target['id']}")
+        for target in targets
+    ]
+
+    durations = []
+    for index in range(400):
+        expression = page_controller_call("mute" if index % 2 else "unmute")
+        start = time.perf_counter()
+        channels[index % len(channels)].evaluate(expression)
+        durations.append((time.perf_counter() - start) * 1000)
+    # first call of each channel includes connecting
+    durations = durations[len(channels) :]
+    print(
+        f"Mute over DevTools: p50 {np.percentile(durations, 50):.2f}ms,"
+        f" p99 {np.percentile(durations, 99):.2f}ms"
+    )
+
+    standin.drop_connections()
+    channels[0].evaluate(page_controller_call("mute"))
+    print("Reconnected after connection dropped.")
+
+    for channel in channels:
+        channel.close()
+    standin.stop()
+
+    if np.percentile(durations, 99) >= 10:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import os
+import random
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from classifier import IMAGE_DIMS
+from model_backends import KerasModel, TFLiteModel
+
+"""
+Convert trained .keras classifier to .tflite file, which Classifier can run without
+importing TensorFlow (much faster startup and less memory), and check that both give
+the same outputs.
+
+Run with python3 export_model.py ml_models/part5_cropped_5-29-24.keras
+"""
+
+SAMPLES_DIRECTORY = "ml_models/model_data/val"
+
+
+def convert(model_file_path: str, output_path: str, quantize: bool) -> None:
+    import keras
+    import tensorflow as tf
+
+    model = keras.models.load_model(model_file_path)
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        # converting from a SavedModel keeps the batch dimension dynamic, so that
+        # Classifier.classify_many can still run multiple windows at once
+        model.export(saved_model_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantize:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        tflite_model = converter.convert()
+
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+
+    print(f"Wrote {output_path} ({round(len(tflite_model) / 1e6, 1)} MB).")
+
+
+def load_samples(samples_dir: str, num_samples: int) -> np.ndarray:
+    """Return images from samples_dir (e.g. validation data created by
+    ml_models/setup_datasets.py), or random images if there aren't any"""
+    image_paths = []
+    if os.path.isdir(samples_dir):
+        for path, _, files in os.walk(samples_dir):
+            image_paths += [os.path.join(path, f) for f in files if f.endswith(".jpg")]
+
+    if len(image_paths) == 0:
+        print(f"No images found in {samples_dir}, comparing on random images.")
+        rng = np.random.default_rng(0)
+        return rng.uniform(0, 255, (num_samples, *IMAGE_DIMS, 3)).astype(np.float32)
+
+    image_paths = random.Random(0).sample(
+        image_paths, min(num_samples, len(image_paths))
+    )
+    return np.array(
+        [
+            np.asarray(
+                Image.open(path).convert("RGB").resize((IMAGE_DIMS[1], IMAGE_DIMS[0])),
+                dtype=np.float32,
+            )
+            for path in image_paths
+        ]
+    )
+
+
+def compare(
+    keras_path: str, tflite_path: str, samples: np.ndarray, tolerance: float
+) -> bool:
+    keras_preds = KerasModel(keras_path).predict(samples)[:, 0]
+    tflite_preds = TFLiteModel(tflite_path).predict(samples)[:, 0]
+
+    max_diff = np.abs(keras_preds - tflite_preds).max()
+    same_class = ((keras_preds <= 0.5) == (tflite_preds <= 0.5)).sum()
+    print(f"Max difference between outputs on {len(samples)} images: {max_diff:.2e}")
+    print(f"{same_class}/{len(samples)} images classified the same.")
+
+    return max_diff <= tolerance
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert .keras classifier to .tflite and check that outputs match"
+    )
+    parser.add_argument("model_file_path", help="Path to .keras file")
+    parser.add_argument(
+        "-o", "--output", help="Path of .tflite file (default: next to .keras file)"
+    )
+    parser.add_argument(
+        "-q",
+        "--quantize",
+        action="store_true",
+        help="Quantize weights to 8 bits (smaller and faster, slightly less accurate)",
+    )
+    parser.add_argument(
+        "-s",
+        "--samples",
+        default=SAMPLES_DIRECTORY,
+        help="Directory of images to compare outputs on",
+    )
+    parser.add_argument("-n", "--num-samples", type=int, default=64)
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        help="Largest allowed difference between outputs"
+        " (default: 1e-4, or 5e-2 with --quantize)",
+    )
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = os.path.splitext(args.model_file_path)[0] + ".tflite"
+    if args.tolerance is None:
+        args.tolerance = 5e-2 if args.quantize else 1e-4
+
+    convert(args.model_file_path, args.output, args.quantize)
+    samples = load_samples(args.samples, args.num_samples)
+    if compare(args.model_file_path, args.output, samples, args.tolerance):
+        print("Outputs match.")
+    else:
+        raise Exception(
+            f"Outputs of {args.output} differ from {args.model_file_path} by more"
+            f" than {args.tolerance}."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+(function () {
+  // install controller once per page, so that later calls only need to send e.g.
+  // window.__redzone.mute() instead of a whole script
+  if (window.__redzone !== undefined) {
+    return "installed";
+  }
+
+  // live collection, so it stays up to date without querying the DOM again
+  const videos = document.getElementsByTagName("video");
+  let muted = null;
+
+  // the stream is the largest video on the page
+  const streamVideo = () => {
+    let largest = null;
+    let largestArea = -1;
+    for (const video of videos) {
+      const rect = video.getBoundingClientRect();
+      if (rect.width * rect.height > largestArea) {
+        largest = video;
+        largestArea = rect.width * rect.height;
+      }
+    }
+    return largest;
+  };
+
+  const setMuted = (value) => {
+    muted = value;
+    for (const video of videos) {
+      video.muted = value;
+    }
+    return String(videos.length);
+  };
+
+  // videos that start playing later (e.g. when the stream reloads or an ad is
+  // inserted) get the last requested mute state too
+  document.addEventListener(
+    "play",
+    (e) => {
+      if (muted !== null && e.target instanceof HTMLVideoElement) {
+        e.target.muted = muted;
+      }
+    },
+    true,
+  );
+
+  window.__redzone = {
+    mute: () => setMuted(true),
+    unmute: () => setMuted(false),
+    state: () => {
+      const video = streamVideo();
+      const state = { has_video: video !== null, iframes: [] };
+      if (video === null) {
+        // only video elements can be muted, not iframes
+        state.iframes = Array.from(document.querySelectorAll("iframe")).map(
+          (e) => e.src,
+        );
+      } else {
+        const rect = video.getBoundingClientRect();
+        state.muted = video.muted;
+        state.paused = video.paused;
+        state.current_time = video.currentTime;
+        state.ready_state = video.readyState;
+        state.geometry = {
+          x: rect.x,
+          y: rect.y,
+          w: rect.width,
+          h: rect.height,
+        };
+      }
+      return JSON.stringify(state);
+    },
+  };
+  return "installed";
+})();
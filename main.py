@@ -1,6 +1,7 @@
 import argparse
 
-from constants import DATA_DIRECTORY, DEFAULT_PORT, MODEL_FILE_PATH
+import tracing
+from constants import DATA_DIRECTORY, DEFAULT_PORT, INFERENCE_BUDGET, MODEL_FILE_PATH
 from utils import choose_space
 
 
@@ -17,7 +18,7 @@ def setup_parser() -> argparse.ArgumentParser:
         "-c",
         "--classifier-path",
         default=MODEL_FILE_PATH,
-        help="Path to classifier .keras file",
+        help="Path to classifier .keras or .tflite file",
     )
     parser.add_argument(
         "-p",
@@ -39,6 +40,20 @@ def setup_parser() -> argparse.ArgumentParser:
         help=f"Save screenshots to {DATA_DIRECTORY} directory"
         " every minute for classifier training",
     )
+    parser.add_argument(
+        "-b",
+        "--inference-budget",
+        type=float,
+        default=INFERENCE_BUDGET,
+        help="Frames per second that may be classified across all streams. Checks of"
+        " the main stream come first, and the other streams share the rest",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write timed spans of each check of the main stream to FILE as JSON lines"
+        " (summarize with trace_summary.py)",
+    )
     parser.add_argument(
         "URLs",
         nargs=argparse.REMAINDER,
@@ -57,6 +72,9 @@ def main() -> None:
         if args.space is None:
             args.space = choose_space()
 
+        if args.trace is not None:
+            tracing.enable(args.trace)
+
         from manage_streams import StreamManager
 
         manager = StreamManager(
@@ -66,6 +84,7 @@ def main() -> None:
             server_port=args.port,
             gather_data=args.take_screenshots,
             cover_commercials=not args.no_cover,
+            inference_budget=args.inference_budget,
         )
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt received, aborting.")
@@ -1,36 +1,55 @@
+import asyncio
+import functools
+import json
 import logging
 import os
 import subprocess
 import time
-from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from typing import Any, Callable, Coroutine, Hashable
 
 import flask.cli
-from flask import Flask, render_template
-
+from flask import Flask, Response, render_template, request
+
+import metrics
+import tracing
+from action_queue import ActionQueue
+from actuators import YabaiActuator
+from background_scorer import BackgroundScorer
+from browser_control import BrowserController
 from classifier import Classifier
+from commercial_tracker import CommercialTracker
 from constants import (
+    COMMERCIAL_ENTER_THRESHOLD,
+    CONFIRM_UPDATE_RATE,
     DEFAULT_PORT,
     DEFAULT_UPDATE_RATE,
     HALFTIME_DURATION,
+    INFERENCE_BUDGET,
     MODEL_FILE_PATH,
+    RESIZE_SETTLE_SECONDS,
+    SNOOZE_DURATION,
 )
+from signal_intake import SignalIntake
+from state_stream import StateStream
 from take_screenshots import ScreenshotTaker
+from timers import TimerService
 from utils import (
     choose_main_window_id,
     chrome_cli_execute,
     close_window,
     control_stream_audio,
     convert_open_windows_to_minimal,
-    cover_window,
     get_chrome_cli_ids,
     get_window_video_elements,
-    get_windows,
     let_user_choose_iframe,
     open_commercial_cover,
     open_stream_windows,
     run_shell,
     strip_win_title,
 )
+from window_registry import WindowRegistry
 
 
 class StreamManager:
@@ -46,18 +65,10 @@ class StreamManager:
         gather_data: bool = False,
         cover_commercials: bool = True,
         update_rate: int = DEFAULT_UPDATE_RATE,
+        inference_budget: float = INFERENCE_BUDGET,
     ) -> None:
-        self.classifier = Classifier(classifier_path)
-        # keys: window IDs, values: True to force that window as showing a commercial,
-        # False to force it as showing NBA
-        self.force_windows: dict[int, bool] = {}
-        self.lock = Lock()
-        self.update_rate = update_rate
-        self.during_halftime = False
-        self.windows_are_fullscreen = False
-        self.last_focus_called = time.time()
-        self.last_fullscreen_called = time.time()
-
+        # load model while windows are opened and set up
+        self.classifier = Classifier(classifier_path, load_in_background=True)
         self.space = space
 
         if len(urls) == 0:
@@ -73,7 +84,7 @@ class StreamManager:
 
         self.id_dict = get_chrome_cli_ids(windows)
 
-        self.main_id, title = choose_main_window_id(windows)
+        main_id, title = choose_main_window_id(windows)
         print(f'Selected main window with title "{title}" in space {self.space}.')
 
         # check if can execute js using chrome-cli
@@ -81,7 +92,7 @@ class StreamManager:
         if (
             chrome_cli_execute(
                 "javascript/test.js",
-                self.id_dict[self.main_id],
+                self.id_dict[main_id],
                 {"TEST_VALUE": test_val},
             ).strip()
             != test_val
@@ -92,15 +103,18 @@ class StreamManager:
                 " browser options?"
             )
 
-        self.was_commercial: dict[int, bool] = {}
-        # initialize all windows as not showing commercials
+        # for remote to show which stream is which
+        titles = {win["id"]: strip_win_title(win["title"]) for win in windows}
+        self._init_state(main_id, titles, update_rate, inference_budget)
+
+        # mute all non-main windows
         for win_id, chrome_cli_id in self.id_dict.items():
-            self.was_commercial[win_id] = False
-            # mute all non-main windows
             if win_id != self.main_id:
                 control_stream_audio(chrome_cli_id, mute=True)
 
         self.handle_iframes(windows)
+        # after handle_iframes, since it can change the page shown in tabs
+        self.browser = BrowserController(self.id_dict)
 
         # turn off yabai mouse_follows_focus so that focusing cover window doesn't move
         # mouse
@@ -114,6 +128,10 @@ class StreamManager:
         else:
             self.cover_id = None
 
+        self.window_registry = WindowRegistry(self.space)
+        self.window_registry.start_reconciling()
+        self.actuator = YabaiActuator(self.window_registry, self.browser)
+
         self._start_flask_server(server_port)
 
         # send window focus request when window is focused
@@ -145,13 +163,91 @@ class StreamManager:
             " or software will not work.\n"
         )
 
+    def _init_state(
+        self,
+        main_id: int,
+        titles: dict[int, str],
+        update_rate: int,
+        inference_budget: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Set up state that doesn't need yabai or a browser, shared with
+        ReplayStreamManager (see replay.py). Expects self.classifier, and
+        self.actuator before the main loop starts. titles are the window titles by
+        window ID, and clock is passed to the background scorer"""
+        # keys: window IDs, values: True to force that window as showing a commercial,
+        # False to force it as showing NBA
+        self.force_windows: dict[int, bool] = {}
+        # main loop ticks, requests from the remote and yabai signals all run on this
+        # event loop in the main thread, one at a time, so the state above and below is
+        # only changed there. Blocking work (classifying, acting on windows) runs in
+        # other threads and is awaited, so other events are handled in the meantime
+        self.loop = asyncio.new_event_loop()
+        self.inference_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="inference"
+        )
+        self.update_rate = update_rate
+        self.during_halftime = False
+        # halftime, timed commercial forces and snoozes
+        self.timers = TimerService()
+        # windows not to switch to until their snooze timer runs out
+        self.snoozed: set[int] = set()
+        # pushes state to remotes whenever it changes
+        self.state_stream = StateStream()
+        self.last_published_state: str | None = None
+        # yabai signals, handled in bursts
+        self.signal_intake = SignalIntake()
+        self.signal_intake.register(
+            "focus", self.publishing(self.focus_window), latest_only=True
+        )
+        self.signal_intake.register(
+            "resize",
+            self.publishing(self.handle_resize),
+            settle=RESIZE_SETTLE_SECONDS,
+        )
+
+        self.main_id = main_id
+        # stream being watched and whether windows are fullscreen. Window actions
+        # change these in the action thread, where they work on their own copies, and
+        # return them so that the loop applies them once they're done
         # TODO: update this with keybinds too (threading)
-        self.focused_id = self.main_id
+        self.focused_id = main_id
+        self.windows_are_fullscreen = False
+        self.action_focused_id = main_id
+        self.action_fullscreen = False
+        self.titles = titles
+        # initialize all windows as not showing commercials
+        self.was_commercial = {win_id: False for win_id in titles}
+        self.trackers: dict[int, CommercialTracker] = {}
+        # keys: window IDs, values: latest probability that window shows a commercial
+        self.scores: dict[int, float] = {}
+
+        self.action_queue = ActionQueue()
+        self.background_scorer = BackgroundScorer(
+            self.classifier,
+            self.other_window_ids,
+            on_scores=self.update_scores_threadsafe,
+            budget=inference_budget,
+            main_rate=1 / update_rate,
+            clock=clock,
+        )
 
     def __del__(self) -> None:
         if hasattr(self, "classifier"):
             self.classifier.__del__()
 
+        if hasattr(self, "action_queue"):
+            self.action_queue.close()
+
+        if hasattr(self, "inference_executor"):
+            self.inference_executor.shutdown(wait=False)
+
+        if hasattr(self, "actuator"):
+            self.actuator.close()
+
+        if hasattr(self, "browser"):
+            self.browser.close()
+
         if hasattr(self, "cover_id") and self.cover_id is not None:
             close_window(self.cover_id)
             print("Commercial cover window closed.")
@@ -181,18 +277,32 @@ class StreamManager:
 
         # add routes
         self.app.route("/")(self.flask_main_route)
+        self.app.route("/metrics")(self.on_loop(self.handle_metrics_request))
+        self.app.route("/state")(self.on_loop(self.handle_state_request))
+        self.app.route("/events")(self.handle_events_request)
         self.app.route("/force-halftime", methods=["POST"])(
-            self.handle_halftime_request
+            self.on_loop(self.handle_halftime_request)
         )
         self.app.route("/force-commercial", methods=["POST"])(
-            self.handle_force_commercial_request
+            self.on_loop(self.handle_force_commercial_request, "minutes")
+        )
+        self.app.route("/snooze/<int:win_id>", methods=["POST"])(
+            self.on_loop(self.handle_snooze_request, "minutes")
+        )
+        self.app.route("/timers/<name>/cancel", methods=["POST"])(
+            self.on_loop(self.handle_cancel_timer_request)
+        )
+        self.app.route("/timers/<name>/extend", methods=["POST"])(
+            self.on_loop(self.handle_extend_timer_request, "minutes")
+        )
+        self.app.route("/force-nba", methods=["POST"])(
+            self.on_loop(self.handle_force_nba_request)
         )
-        self.app.route("/force-nba", methods=["POST"])(self.handle_force_nba_request)
         self.app.route("/focus/<int:win_id>", methods=["POST"])(
-            self.handle_focus_window_request
+            self.on_loop(self.handle_focus_window_request)
         )
         self.app.route("/toggle-fullscreen/<int:win_id>", methods=["POST"])(
-            self.handle_toggle_fullscreen_request
+            self.on_loop(self.handle_toggle_fullscreen_request)
         )
 
         # run Flask app in background thread
@@ -213,175 +323,347 @@ class StreamManager:
         message += f"http://{ip}{port_str} has been copied to clipboard."
         print(message)
 
+    def on_loop(
+        self, handler: Callable[..., Coroutine], *number_params: str
+    ) -> Callable:
+        """Return Flask view that runs handler on the event loop and waits for its
+        response (Flask handles each request in its own thread). number_params are
+        passed to handler as keyword arguments if given in query string or JSON
+        body."""
+
+        @functools.wraps(handler)
+        def view(*args, **kwargs) -> Any:
+            body = request.get_json(silent=True) if len(number_params) > 0 else None
+            if not isinstance(body, dict):
+                body = {}
+            for param in number_params:
+                value = body.get(param, request.args.get(param))
+                if value is None:
+                    continue
+                try:
+                    kwargs[param] = float(value)
+                except ValueError:
+                    return {"message": f"{param} must be a number"}, 400
+
+            return asyncio.run_coroutine_threadsafe(
+                self.publishing_state(handler(*args, **kwargs)), self.loop
+            ).result()
+
+        return view
+
+    def publishing(self, handler: Callable[..., Coroutine]) -> Callable[..., Coroutine]:
+        """Return handler that pushes state to remotes after handler is done"""
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs) -> Coroutine:
+            return self.publishing_state(handler(*args, **kwargs))
+
+        return wrapper
+
+    async def publishing_state(self, coroutine: Coroutine) -> Any:
+        """Await coroutine, then push state to remotes in case it changed"""
+        try:
+            return await coroutine
+        finally:
+            self.publish_state()
+
+    async def run_blocking(self, func: Callable, *args) -> Any:
+        """Run func in inference thread without blocking event loop"""
+        return await self.loop.run_in_executor(
+            self.inference_executor,
+            tracing.in_current_span(functools.partial(func, *args)),
+        )
+
+    async def run_action(self, action: Callable[[], Any], key: Hashable = None) -> Any:
+        """Run action in action queue (see ActionQueue.submit) without blocking event
+        loop"""
+        return await asyncio.wrap_future(self.action_queue.submit(action, key))
+
     def flask_main_route(self) -> str:
         return render_template("index.html")
 
-    def handle_focus_window_request(
-        self, win_id: int
-    ) -> tuple[dict[str, str], int] | dict[str, str]:
-        """Focus window with given ID and make that window the new main window"""
-        # debounce calls due to yabai signals
-        if time.time() - self.last_focus_called < 1:
-            return {"message": "Must wait >= 1 second between calls"}, 400
-        self.last_focus_called = time.time()
+    async def handle_metrics_request(self) -> Response:
+        """Return metrics in Prometheus text format"""
+        metrics.main_window.set(self.main_id)
+        metrics.main_commercial.set(int(self.was_commercial[self.main_id]))
+        forced = self.force_windows.get(self.main_id)
+        metrics.main_forced.set(0 if forced is None else (1 if forced else -1))
+        metrics.halftime.set(int(self.during_halftime))
+        for win_id, is_commercial in self.was_commercial.items():
+            metrics.window_commercial.set(int(is_commercial), window=win_id)
+        for win_id, score in self.scores.items():
+            metrics.window_score.set(score, window=win_id)
+        for win_id, rate in self.background_scorer.sample_rates().items():
+            metrics.window_sample_rate.set(rate, window=win_id)
+
+        return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+    def state(self) -> dict:
+        """Return main window, whether it's showing a commercial and why, titles and
+        latest scores of all windows and remaining seconds of timers"""
+        return {
+            "main_id": self.main_id,
+            "focused_id": self.focused_id,
+            "commercial": self.was_commercial[self.main_id],
+            "forced": self.force_windows.get(self.main_id),
+            "halftime": self.during_halftime,
+            "fullscreen": self.windows_are_fullscreen,
+            "titles": self.titles,
+            "scores": self.scores,
+            "snoozed": sorted(self.snoozed),
+            "timers": self.timers.remaining_all(),
+        }
+
+    def publish_state(self) -> None:
+        """Push state to remotes if it changed since it was last pushed"""
+        state = self.state()
+        # remaining time of timers is different every time, so compare their
+        # deadlines instead (remotes count down by themselves)
+        key = json.dumps(
+            {
+                **state,
+                "timers": {
+                    name: round(time.time() + remaining)
+                    for name, remaining in state["timers"].items()
+                },
+            },
+            sort_keys=True,
+        )
+        if key != self.last_published_state:
+            self.last_published_state = key
+            self.state_stream.publish(state)
+
+    async def handle_state_request(self) -> dict:
+        return self.state()
+
+    def handle_events_request(self) -> Response:
+        """Stream state to remote as Server-Sent Events, sending it again whenever it
+        changes"""
+        return Response(
+            self.state_stream.events(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
 
-        if win_id not in [win["id"] for win in get_windows(self.space)]:
-            return {"message": f"{win_id} is not a stream window"}, 400
-        elif win_id == self.focused_id:
-            return {"message": f"{win_id} is already focused"}, 400
+    async def handle_focus_window_request(self, win_id: int) -> dict:
+        """Queue yabai signal that window with given ID was focused"""
+        self.window_registry.set_focused(win_id)
+        self.signal_intake.submit("focus", win_id)
+        return {}
+
+    async def focus_window(self, win_id: int) -> str | None:
+        """Make focused window with given ID the new main window, or return why it
+        isn't"""
+        if win_id not in [win["id"] for win in self.actuator.get_windows()]:
+            return "not_stream_window"
+        elif win_id == self.focused_id or self.actuator.focused_by_self(win_id):
+            # focused by this program when switching streams, whose signal can arrive
+            # before the switch is done and focused_id is updated
+            return "already_focused"
         elif win_id == self.main_id:
-            return {"message": f"{win_id} is already main window"}, 400
+            return "already_main"
 
-        with self.lock:
-            self.was_commercial[self.main_id] = False
-            self.main_id = win_id
+        self.was_commercial[self.main_id] = False
+        self.main_id = win_id
 
         print(f"Switched main ID to {win_id}")
-        self.return_to_main()
-
+        await self.return_to_main()
+
+    async def handle_toggle_fullscreen_request(self, win_id: int) -> dict:
+        """Queue yabai signal that window with given ID was resized"""
+        # streams move within their windows when windows are resized
+        self.classifier.invalidate_crop_points(win_id)
+        self.window_registry.frame_changed(win_id)
+        self.signal_intake.submit("resize", win_id)
         return {}
 
-    def handle_toggle_fullscreen_request(
-        self, win_id: int
-    ) -> tuple[dict[str, str], int] | dict[str, str]:
-        # yabai calls this too often bc of resizing windows, so debounce
-        if time.time() - self.last_fullscreen_called < 1:
-            return {"message": "Must wait >= 1 second between calls"}, 400
-        self.last_fullscreen_called = time.time()
+    async def handle_resize(self, win_id: int) -> str | None:
+        """Fullscreen/tile all windows like the resized window with given ID, or return
+        why they aren't"""
         if win_id != self.focused_id:
-            return {"message": "Can only fullscreen focused window"}, 400
+            # e.g. other windows resized along with focused one
+            return "not_focused"
 
-        windows = get_windows(self.space)
+        self.windows_are_fullscreen = await self.run_action(self.toggle_fullscreen)
 
-        if not self.windows_are_fullscreen:
+    def toggle_fullscreen(self) -> bool:
+        """Fullscreen focused window (with all other windows behind it) if in tile
+        view, otherwise switch back to tile view. Returns whether windows are now
+        fullscreen"""
+        # window was resized outside of this program, so registry doesn't know whether
+        # it is fullscreen yet
+        self.window_registry.refresh()
+        windows = self.actuator.get_windows()
+
+        if not self.action_fullscreen:
             print("Fullscreening windows")
-            self.fullscreen_window(windows, self.focused_id)
+            self.fullscreen_window(windows, self.action_focused_id)
         else:
             print("Switching back to tile view")
-            for win in windows:
-                if win["id"] != self.cover_id and win["fullscreen"]:
-                    run_shell(f"yabai -m window {win['id']} --toggle zoom-fullscreen")
-
-        with self.lock:
-            self.windows_are_fullscreen = not self.windows_are_fullscreen
+            with self.actuator.batch():
+                for win in windows:
+                    if win["id"] != self.cover_id and win["fullscreen"]:
+                        self.actuator.toggle_fullscreen(win["id"])
 
-        return {}
+        self.action_fullscreen = not self.action_fullscreen
+        return self.action_fullscreen
 
-    def handle_halftime_request(
+    async def handle_halftime_request(
         self,
     ) -> tuple[dict[str, int | str], int] | dict[str, int]:
-        """Start/stop halftime break in main window"""
-        with self.lock:
-            if self.during_halftime:
-                return {"message": "already during halftime"}, 400
+        """Start halftime break in main window (stop it early with
+        /timers/halftime/cancel)"""
+        if self.during_halftime:
+            return {"message": "already during halftime"}, 400
 
-        Thread(target=self.force_halftime, daemon=True).start()
+        # halftime takes over a timed commercial force
+        self.timers.cancel("force-commercial")
+        self.timers.schedule("halftime", HALFTIME_DURATION, self.end_halftime)
+        await self.start_halftime()
 
         return {"timeout": HALFTIME_DURATION}
 
-    def handle_force_commercial_request(
-        self,
-    ) -> tuple[dict[str, str], int] | dict[str, str]:
-        """Start/stop untimed commercial break in main window"""
-        with self.lock:
-            if self.during_halftime:
-                return {"message": "cannot force commercial during halftime"}, 400
-            # force commercial if no previous force or if previous force was NBA
-            if not self.force_windows.get(self.main_id, False):
-                force_commercial = True
-                self.force_windows[self.main_id] = True
+    async def handle_force_commercial_request(
+        self, minutes: float | None = None
+    ) -> tuple[dict[str, str], int] | dict[str, str | float]:
+        """Start/stop commercial break in main window, which ends by itself after
+        given number of minutes if specified"""
+        if self.during_halftime:
+            return {"message": "cannot force commercial during halftime"}, 400
+        # force commercial if no previous force or if previous force was NBA
+        if not self.force_windows.get(self.main_id, False):
+            self.force_windows[self.main_id] = True
+            response = {"next_action": "Stop forcing commercial"}
+            if minutes is not None:
+                self.timers.schedule(
+                    "force-commercial",
+                    minutes * 60,
+                    functools.partial(self.end_forced_commercial, self.main_id),
+                )
+                response["timeout"] = minutes * 60
 
-                if self.was_commercial[self.main_id]:
-                    # set was_commercial to False, so that when checks resume, they will
-                    # swich away from main if commercial again
-                    self.was_commercial[self.main_id] = False
-                    skip_switch_away = True
-                else:
-                    skip_switch_away = False
+            if self.was_commercial[self.main_id]:
+                # set was_commercial to False, so that when checks resume, they will
+                # swich away from main if commercial again
+                self.was_commercial[self.main_id] = False
             else:
-                force_commercial = False
-                del self.force_windows[self.main_id]
-                skip_switch_away = False
-
-        if force_commercial:
-            if not skip_switch_away:
-                self.switch_away_from_main()
-            return {"next_action": "Stop forcing commercial"}
+                await self.switch_away_from_main()
+            return response
         else:
-            self.return_to_main()
+            self.timers.cancel("force-commercial")
+            del self.force_windows[self.main_id]
+            await self.return_to_main()
             return {"next_action": "Force commercial"}
 
-    def handle_force_nba_request(self) -> dict[str, str]:
+    async def end_forced_commercial(self, win_id: int) -> None:
+        # halftime or forcing NBA may have replaced the force in the meantime
+        if self.during_halftime or not self.force_windows.get(win_id, False):
+            return
+
+        del self.force_windows[win_id]
+        if win_id == self.main_id:
+            await self.return_to_main()
+        self.publish_state()
+
+    async def handle_snooze_request(
+        self, win_id: int, minutes: float = SNOOZE_DURATION / 60
+    ) -> tuple[dict[str, str], int] | dict[str, float]:
+        """Don't switch to window with given ID for given number of minutes (e.g.
+        because its game is a blowout)"""
+        if win_id not in self.id_dict:
+            return {"message": f"{win_id} is not a stream window"}, 400
+        elif win_id == self.main_id:
+            return {"message": "cannot snooze main window"}, 400
+
+        self.snoozed.add(win_id)
+        self.timers.schedule(
+            f"snooze-{win_id}", minutes * 60, functools.partial(self.end_snooze, win_id)
+        )
+        # switch to another stream if currently watching this one
+        if self.focused_id == win_id:
+            await self.switch_away_from_main()
+
+        return {"timeout": minutes * 60}
+
+    async def end_snooze(self, win_id: int) -> None:
+        self.snoozed.discard(win_id)
+        self.publish_state()
+
+    async def handle_cancel_timer_request(
+        self, name: str
+    ) -> tuple[dict[str, str], int] | dict[str, str]:
+        """End halftime, timed commercial force or snooze now"""
+        if not await self.timers.finish(name):
+            return {"message": f'no timer named "{name}"'}, 404
+        return {}
+
+    async def handle_extend_timer_request(
+        self, name: str, minutes: float = 5
+    ) -> tuple[dict[str, str], int] | dict[str, float]:
+        """Make halftime, timed commercial force or snooze last given number of
+        minutes longer (or shorter if negative)"""
+        if not self.timers.extend(name, minutes * 60):
+            return {"message": f'no timer named "{name}"'}, 404
+        return {"timeout": self.timers.remaining(name)}
+
+    async def handle_force_nba_request(self) -> dict[str, str]:
         """Force/stop forcing showing game in main window"""
-        with self.lock:
-            # force NBA if no previous force or if previous force was commercial
-            if self.force_windows.get(self.main_id, True):
-                if self.force_windows.get(self.main_id, None) is None:
-                    return_to_main = self.was_commercial[self.main_id]
-                else:
-                    # return_to_main = True if previous force was commercial, bc
-                    # handle_force_commercial_request sets was_commercial to False
-                    return_to_main = True
-                self.force_windows[self.main_id] = False
-                self.was_commercial[self.main_id] = False
-                force_nba = True
-                switch_back_to_halftime = False
+        # force NBA if no previous force or if previous force was commercial
+        if self.force_windows.get(self.main_id, True):
+            if self.force_windows.get(self.main_id, None) is None:
+                return_to_main = self.was_commercial[self.main_id]
             else:
-                # go back to forced commercial if stopping NBA force while halftime is
-                # still ongoing
-                if self.during_halftime:
-                    self.force_windows[self.main_id] = True
-                    switch_back_to_halftime = True
-                else:
-                    # delete force if previous force was NBA (i.e. toggle)
-                    del self.force_windows[self.main_id]
-                    switch_back_to_halftime = False
-                return_to_main = False
-                force_nba = False
-
-        if force_nba:
+                # return_to_main = True if previous force was commercial, bc
+                # handle_force_commercial_request sets was_commercial to False
+                return_to_main = True
+            self.timers.cancel("force-commercial")
+            self.force_windows[self.main_id] = False
+            self.was_commercial[self.main_id] = False
             if return_to_main:
-                self.return_to_main()
+                await self.return_to_main()
             return {"next_action": "Stop forcing NBA"}
         else:
-            if switch_back_to_halftime:
-                self.switch_away_from_main()
+            # go back to forced commercial if stopping NBA force while halftime is
+            # still ongoing
+            if self.during_halftime:
+                self.force_windows[self.main_id] = True
+                await self.switch_away_from_main()
+            else:
+                # delete force if previous force was NBA (i.e. toggle)
+                del self.force_windows[self.main_id]
             return {"next_action": "Force NBA"}
 
-    def force_halftime(self) -> None:
-        """Switch to other stream for the duration of halftime in main
-        stream, then switch back to main stream.
-        """
-        with self.lock:
-            self.during_halftime = True
+    async def start_halftime(self) -> None:
+        """Switch to other stream until end_halftime is called"""
+        self.during_halftime = True
 
-            if self.was_commercial[self.main_id]:
-                self.was_commercial[self.main_id] = False
-                skip_switch_away = True
-            else:
-                skip_switch_away = False
+        if self.was_commercial[self.main_id]:
+            self.was_commercial[self.main_id] = False
+            skip_switch_away = True
+        else:
+            skip_switch_away = False
 
-            # skip switching away if commercial already forced by
-            # handle_force_commercial_request
-            if self.force_windows.get(self.main_id, False):
-                skip_switch_away = True
-            else:
-                self.force_windows[self.main_id] = True
+        # skip switching away if commercial already forced by
+        # handle_force_commercial_request
+        if self.force_windows.get(self.main_id, False):
+            skip_switch_away = True
+        else:
+            self.force_windows[self.main_id] = True
 
         if not skip_switch_away:
-            self.switch_away_from_main()
-
-        time.sleep(HALFTIME_DURATION)
+            await self.switch_away_from_main()
 
-        with self.lock:
-            return_to_main = self.force_windows.get(self.main_id, True)
-            # don't delete force_window if force got changed to NBA during halftime
-            if return_to_main:
-                del self.force_windows[self.main_id]
-            self.during_halftime = False
+    async def end_halftime(self) -> None:
+        """Switch back to main stream"""
+        return_to_main = self.force_windows.get(self.main_id, True)
+        # don't delete force_window if force got changed to NBA during halftime
+        if return_to_main:
+            self.force_windows.pop(self.main_id, None)
+        self.during_halftime = False
 
         if return_to_main:
-            self.return_to_main()
+            await self.return_to_main()
+        self.publish_state()
 
     def handle_iframes(self, windows: list[dict]) -> None:
         """Can't mute/unmute a page with JavaScript if its video elements are playing
@@ -401,52 +683,127 @@ class StreamManager:
 
                 let_user_choose_iframe(title, iframes, chrome_cli_id)
 
+    @tracing.traced()
     def fullscreen_window(self, windows: list[dict], window_id: int) -> None:
         """If in tile view, call without specifying window_id to fullscreen focused window
         (and fullscreen all other windows behind it). If all windows are fullscreened, specify
         window_id of window to bring to front. This will also unmute it and mute previous
         front window.
         """
-        for window in windows:
-            if window["id"] != self.cover_id:
-                if not window["fullscreen"]:
-                    run_shell(
-                        f"yabai -m window {window['id']} --toggle zoom-fullscreen"
-                    )
-                if window["id"] == window_id:
-                    with self.lock:
-                        self.focused_id = window_id
-                    run_shell(f"yabai -m window {window['id']} --focus")
-                control_stream_audio(
-                    self.id_dict[window["id"]], mute=(window["id"] != window_id)
-                )
-
-    def win_is_commercial(
-        self, win_id: int, double_check: bool = True, force: bool | None = None
-    ) -> bool:
-        if force is not None:
-            is_commercial = force
-        else:
-            is_commercial = self.classifier.classify(win_id, double_check)
+        stream_ids = [win["id"] for win in windows if win["id"] != self.cover_id]
+
+        def bring_to_front() -> None:
+            # run all yabai commands together, then unmute once window is in front
+            with self.actuator.batch():
+                for window in windows:
+                    if window["id"] in stream_ids:
+                        if not window["fullscreen"]:
+                            self.actuator.toggle_fullscreen(window["id"])
+                        if window["id"] == window_id:
+                            self.actuator.focus(window["id"])
+            if window_id in stream_ids:
+                self.actuator.set_muted(window_id, mute=False)
+
+        # mute the other windows meanwhile
+        self.actuator.run_parallel(
+            bring_to_front,
+            *[
+                functools.partial(self.actuator.set_muted, win_id, mute=True)
+                for win_id in stream_ids
+                if win_id != window_id
+            ],
+        )
 
-        with self.lock:
-            self.was_commercial[win_id] = is_commercial
+    def track_score(self, win_id: int, score: float) -> bool:
+        """Add new score of window to its tracker and return whether window should now
+        be considered to be showing a commercial"""
+        self.background_scorer.store({win_id: score})
+        self.scores[win_id] = score
+        tracker = self.trackers.setdefault(win_id, CommercialTracker())
+        is_commercial = tracker.update(self.was_commercial[win_id], score)
+        self.was_commercial[win_id] = is_commercial
+        if tracker.pending:
+            print("waiting for next frame to confirm")
 
         return is_commercial
 
-    def switch_away_from_main(self) -> None:
+    def other_window_ids(self) -> list[int]:
+        """Return IDs of stream windows other than the main one that aren't snoozed"""
+        return [
+            win["id"]
+            for win in self.actuator.get_windows()
+            if win["id"] not in [self.main_id, self.cover_id]
+            and win["id"] not in self.snoozed
+        ]
+
+    def update_scores(self, scores: dict[int, float]) -> None:
+        """Save scores of windows that aren't tracked by the main loop. Skips the main
+        window, which may have become main while the scores were computed, since its
+        tracker decides whether it shows a commercial"""
+        for win_id, score in scores.items():
+            if win_id == self.main_id:
+                continue
+            self.scores[win_id] = score
+            self.was_commercial[win_id] = score >= COMMERCIAL_ENTER_THRESHOLD
+        self.publish_state()
+
+    def update_scores_threadsafe(self, scores: dict[int, float]) -> None:
+        """Save scores from a thread other than the event loop's"""
+        self.loop.call_soon_threadsafe(self.update_scores, scores)
+
+    def wins_scores(self, win_ids: list[int]) -> dict[int, float]:
+        """Return scores of all given windows, taken from background scorer if recent
+        enough, classifying the rest in one batch"""
+        scores = self.background_scorer.recent_scores(win_ids)
+        tracing.current_span().set(background_scores=len(scores))
+
+        missing_ids = [win_id for win_id in win_ids if win_id not in scores]
+        if len(missing_ids) > 0:
+            new_scores = self.classifier.classify_many(missing_ids)
+            self.background_scorer.store(new_scores)
+            self.update_scores_threadsafe(new_scores)
+            scores.update(new_scores)
+
+        return scores
+
+    async def switch_away_from_main(self) -> None:
+        """Switch to (or cover main window until) a stream showing a game. Runs in
+        action queue, where it replaces a switch that hasn't started yet."""
+        self.focused_id = await self.run_action(
+            self._switch_away_from_main, key="switch"
+        )
+
+    async def return_to_main(self) -> None:
+        """Switch back to main stream. Runs in action queue, where it replaces a switch
+        that hasn't started yet."""
+        self.focused_id = await self.run_action(self._return_to_main, key="switch")
+
+    def _switch_away_from_main(self) -> int:
+        """Returns ID of window watched now"""
         print("switching away from main stream")
+        metrics.switches.inc(direction="away")
         # find non-main window that isn't showing a commercial
         new_id = None
-        windows = get_windows(self.space)
+        windows = self.actuator.get_windows()
         # windows are either all fullscreen or all tiled, so can just check first one
         fullscreen = windows[0]["fullscreen"]
-        for win in windows:
-            if win["id"] != self.main_id and win["id"] != self.cover_id:
-                if not self.win_is_commercial(win["id"], False):
-                    new_id = win["id"]
-                    self.focused_id = new_id
-                    break
+        other_ids = self.other_window_ids()
+        # switch to the other window that looks most like a game
+        scores = self.wins_scores(other_ids)
+        game_ids = [
+            win_id
+            for win_id in other_ids
+            if scores[win_id] < COMMERCIAL_ENTER_THRESHOLD
+        ]
+        previous_id = self.action_focused_id
+        if previous_id in game_ids:
+            # already switched to a stream showing a game (e.g. when forcing commercial
+            # right after switching away), so don't switch again
+            new_id = previous_id
+        elif len(game_ids) > 0:
+            new_id = min(game_ids, key=lambda win_id: scores[win_id])
+        if new_id is not None:
+            self.action_focused_id = new_id
 
         if fullscreen:
             if new_id is not None:
@@ -454,57 +811,133 @@ class StreamManager:
                 # fullscreen stream showing game
                 self.fullscreen_window(windows, new_id)
             else:
-                if self.cover_id is not None:
-                    cover_window(self.main_id, self.cover_id)
-                control_stream_audio(self.id_dict[self.main_id], mute=True)
+                self.actuator.run_parallel(*self.cover_and_mute_main_actions())
         else:
             print("muting")
-            if self.cover_id is not None:
-                cover_window(self.main_id, self.cover_id)
-            control_stream_audio(self.id_dict[self.main_id], mute=True)
+            actions = self.cover_and_mute_main_actions()
+            # already switched to a stream that isn't the one to switch to now (e.g.
+            # because it was snoozed)
+            if previous_id not in [self.main_id, self.cover_id, new_id]:
+                actions.append(
+                    functools.partial(self.actuator.set_muted, previous_id, mute=True)
+                )
             if new_id is not None:
                 # switch to stream showing game
                 print("switching to other frame")
-                control_stream_audio(self.id_dict[new_id], mute=False)
+                actions.append(
+                    functools.partial(self.actuator.set_muted, new_id, mute=False)
+                )
+            self.actuator.run_parallel(*actions)
+
+        return self.action_focused_id
 
-    def return_to_main(self) -> None:
+    def cover_and_mute_main_actions(self) -> list[Callable[[], None]]:
+        """Return independent actions that cover and mute main window"""
+        actions = [functools.partial(self.actuator.set_muted, self.main_id, mute=True)]
+        if self.cover_id is not None:
+            actions.append(
+                functools.partial(self.actuator.cover, self.main_id, self.cover_id)
+            )
+        return actions
+
+    def _return_to_main(self) -> int:
+        """Returns ID of window watched now (the main one)"""
         print("returning to main stream")
-        windows = get_windows(self.space)
+        metrics.switches.inc(direction="back")
+        windows = self.actuator.get_windows()
         fullscreen = windows[0]["fullscreen"]
 
         if fullscreen:
             print("Covering window")
             self.fullscreen_window(windows, self.main_id)
         else:
-            run_shell(f"yabai -m window {self.main_id} --focus")
-            if self.focused_id not in [self.main_id, self.cover_id]:
-                control_stream_audio(self.id_dict[self.focused_id], mute=True)
-            control_stream_audio(self.id_dict[self.main_id], mute=False)
-            self.focused_id = self.main_id
 
-    def handle_if_main_commercial(self) -> None:
+            def focus_main() -> None:
+                self.actuator.focus(self.main_id)
+                self.actuator.set_muted(self.main_id, mute=False)
+
+            actions = [focus_main]
+            if self.action_focused_id not in [self.main_id, self.cover_id]:
+                actions.append(
+                    functools.partial(
+                        self.actuator.set_muted, self.action_focused_id, mute=True
+                    )
+                )
+            self.actuator.run_parallel(*actions)
+
+        self.action_focused_id = self.main_id
+        return self.action_focused_id
+
+    async def handle_if_main_commercial(self) -> None:
         print("running handle_if_main_commercial")
-        with self.lock:
-            was_commercial = self.was_commercial[self.main_id]
-            is_forced = self.force_windows.get(self.main_id, None)
+        main_id = self.main_id
+        was_commercial = self.was_commercial[main_id]
+        tick_span = tracing.current_span()
+        tick_span.set(win_id=main_id, decision="forced")
 
         # only check if neither forcing commercial nor NBA
-        if is_forced is None:
+        if self.force_windows.get(main_id) is None:
             print("checking if commercial")
-            is_commercial = self.win_is_commercial(
-                self.main_id, double_check=not was_commercial
+            # a reused score would just repeat the frame that started the pending
+            # switch, so confirming frames always run the model
+            tracker = self.trackers.get(main_id)
+            confirming = tracker is not None and tracker.pending
+            score = await self.run_blocking(
+                functools.partial(
+                    self.classifier.classify, main_id, use_cache=not confirming
+                )
             )
+            # requests and signals are handled while classifying, so main window or
+            # its state may have changed in the meantime
+            if (
+                main_id != self.main_id
+                or self.force_windows.get(main_id) is not None
+                or self.was_commercial[main_id] != was_commercial
+            ):
+                print("main window changed while classifying, ignoring score")
+                tick_span.set(score=score, decision="stale")
+                return
+
+            is_commercial = self.track_score(main_id, score)
+            tick_span.set(score=score, decision="no_change")
             if not was_commercial and is_commercial:
-                self.switch_away_from_main()
+                tick_span.set(decision="switch_away")
+                await self.switch_away_from_main()
             elif was_commercial and not is_commercial:
-                self.return_to_main()
+                tick_span.set(decision="return_to_main")
+                await self.return_to_main()
+
+    async def run(self) -> None:
+        """Check main window for commercials forever"""
+        # keep reference so that task isn't garbage collected
+        self.timers_task = self.loop.create_task(self.timers.run())
+        self.signal_intake_task = self.loop.create_task(self.signal_intake.run())
+        if not self.classifier.model_ready.is_set():
+            print("Waiting for classifier to finish loading...")
+        await self.run_blocking(self.classifier.wait_until_ready)
+        self.background_scorer.start()
+        while True:
+            tracker = self.trackers.get(self.main_id)
+            # check again sooner if main window might be changing state, and have
+            # scores of the other windows ready in case it is
+            if tracker is not None and tracker.pending:
+                self.background_scorer.request_soon()
+                await asyncio.sleep(CONFIRM_UPDATE_RATE)
+            else:
+                await asyncio.sleep(self.update_rate)
+            with tracing.span("tick"):
+                await self.handle_if_main_commercial()
+            self.publish_state()
+            metrics.ticks.inc()
+            metrics.last_tick.set(time.time())
 
     def mainloop(self) -> None:
         try:
-            while True:
-                time.sleep(self.update_rate)
-                self.handle_if_main_commercial()
+            self.loop.run_until_complete(self.run())
         except KeyboardInterrupt:
             print("\nKeyboardInterrupt received, shutting down.")
+            print(self.classifier.frame_cache.summary())
+            print(self.background_scorer.summary())
+            print(self.signal_intake.summary())
             # destructor doesn't run when SIGINT received? So call it explicitly
             self.__del__()
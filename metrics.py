@@ -0,0 +1,307 @@
+import math
+import time
+from threading import Lock
+from typing import Callable
+
+"""
+Minimal Prometheus metrics (counters, gauges and histograms with labels) rendered in
+the Prometheus text exposition format, served by StreamManager at /metrics
+"""
+
+# seconds, for latencies ranging from cached scores to cold Keras predictions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...]) -> str:
+    if len(label_names) == 0:
+        return ""
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, description: str, labels: list[str] = []) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+
+    def label_values(self, labels: dict[str, str | int]) -> tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise Exception(
+                f"{self.name} needs labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str, labels: list[str] = []) -> None:
+        super().__init__(name, description, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+        # unlabeled counters start at 0 instead of missing
+        if len(self.label_names) == 0:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels: str | int) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: list[str] = [],
+        function: Callable[[], float | None] | None = None,
+    ) -> None:
+        """If function is given, the (unlabeled) gauge takes the value it returns each
+        time metrics are rendered, and is left out while it returns None"""
+        super().__init__(name, description, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+        self.function = function
+
+    def set(self, value: float, **labels: str | int) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels: str | int) -> float | None:
+        key = self.label_values(labels)
+        with self.lock:
+            return self.values.get(key)
+
+    def remove(self, **labels: str | int) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            self.values.pop(key, None)
+
+    def samples(self) -> list[str]:
+        if self.function is not None:
+            value = self.function()
+            return [] if value is None else [f"{self.name} {format_value(value)}"]
+
+        with self.lock:
+            values = list(self.values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: list[str] = [],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # keys: label values, values: count in each bucket (not cumulative), sum of
+        # observations
+        self.values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str | int) -> None:
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self.values.items()
+            ]
+
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(
+                    self.label_names + ("le",), key + (format_value(upper_bound),)
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise Exception(f"Metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labels: list[str] = []) -> Counter:
+        return self._register(Counter(name, description, labels))
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        labels: list[str] = [],
+        function: Callable[[], float | None] | None = None,
+    ) -> Gauge:
+        return self._register(Gauge(name, description, labels, function))
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        labels: list[str] = [],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+# defined here instead of next to the code that updates them so that all metrics are
+# listed in one place
+classify_seconds = registry.histogram(
+    "redzone_classify_seconds",
+    "Time to capture, preprocess and score windows in one classifier call",
+    ["stage"],
+)
+inferences = registry.counter(
+    "redzone_inferences_total",
+    "Frames passed to the model, by window",
+    ["window"],
+)
+reused_scores = registry.counter(
+    "redzone_reused_scores_total",
+    "Frames whose previous score was reused instead of running the model, by window",
+    ["window"],
+)
+shell_commands = registry.counter(
+    "redzone_shell_commands_total",
+    "Shell commands run, by program and whether they succeeded",
+    ["program", "success"],
+)
+shell_command_seconds = registry.histogram(
+    "redzone_shell_command_seconds", "Time taken by shell commands", ["program"]
+)
+window_score = registry.gauge(
+    "redzone_window_commercial_score",
+    "Latest probability that window shows a commercial",
+    ["window"],
+)
+window_sample_rate = registry.gauge(
+    "redzone_window_classifications_per_second",
+    "Times window was classified per second over the last minute",
+    ["window"],
+)
+window_commercial = registry.gauge(
+    "redzone_window_commercial",
+    "Whether window is considered to be showing a commercial (1) or a game (0)",
+    ["window"],
+)
+main_window = registry.gauge("redzone_main_window_id", "ID of main stream window")
+main_commercial = registry.gauge(
+    "redzone_main_window_commercial",
+    "Whether main stream is considered to be showing a commercial (1) or a game (0)",
+)
+main_forced = registry.gauge(
+    "redzone_main_window_forced",
+    "Whether main stream is forced as showing a commercial (1), a game (-1) or not"
+    " forced (0)",
+)
+halftime = registry.gauge("redzone_halftime", "Whether halftime break is ongoing")
+switches = registry.counter(
+    "redzone_switches_total",
+    "Switches away from (direction=away) and back to (direction=back) main stream",
+    ["direction"],
+)
+coalesced_actions = registry.counter(
+    "redzone_coalesced_actions_total",
+    "Window actions replaced by a later action before they ran",
+)
+skipped_window_commands = registry.counter(
+    "redzone_skipped_window_commands_total",
+    "Commands not sent because the window was already in that state, by command",
+    ["command"],
+)
+merged_signal_events = registry.counter(
+    "redzone_merged_signal_events_total",
+    "Yabai signal events replaced by a later event of the same burst, by signal",
+    ["signal"],
+)
+dropped_signal_events = registry.counter(
+    "redzone_dropped_signal_events_total",
+    "Yabai signal events that weren't acted on, by signal and reason",
+    ["signal", "reason"],
+)
+ticks = registry.counter("redzone_ticks_total", "Successful main loop ticks")
+last_tick = registry.gauge(
+    "redzone_last_tick_timestamp_seconds", "Unix time of last successful main loop tick"
+)
+
+
+def seconds_since_last_tick() -> float | None:
+    last_tick_time = last_tick.get()
+    if last_tick_time is None:
+        return None
+    return time.time() - last_tick_time
+
+
+registry.gauge(
+    "redzone_seconds_since_last_tick",
+    "Seconds since last successful main loop tick",
+    function=seconds_since_last_tick,
+)
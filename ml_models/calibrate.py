@@ -0,0 +1,111 @@
+import sys
+
+import numpy as np
+from setup_datasets import get_datasets
+from tensorflow import keras
+from tqdm import tqdm
+
+"""
+Fit calibration of classifier scores and thresholds for switching away from/back to
+main stream on validation data, and print values to put in constants.py
+
+Run with python3 calibrate.py part5_cropped_5-29-24.keras
+"""
+
+# fraction of frames of the other class allowed past the enter/exit thresholds
+MAX_WRONG_RATE = 0.02
+# fraction of frames past confident thresholds that must be of the expected class
+CONFIDENT_PRECISION = 0.995
+
+
+def commercial_logits(model_output: np.ndarray) -> np.ndarray:
+    commercial_output = np.clip(1 - model_output, 1e-7, 1 - 1e-7)
+    return np.log(commercial_output / (1 - commercial_output))
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+def fit_platt_scaling(logits: np.ndarray, is_commercial: np.ndarray) -> np.ndarray:
+    """Fit slope and intercept so that sigmoid(slope * logit + intercept) is a
+    calibrated probability of showing a commercial (Newton's method on log loss)"""
+    features = np.stack([logits, np.ones_like(logits)], axis=1)
+    params = np.array([1.0, 0.0])
+    for _ in range(100):
+        probs = sigmoid(features @ params)
+        gradient = features.T @ (probs - is_commercial)
+        hessian = features.T @ (features * (probs * (1 - probs))[:, None])
+        step = np.linalg.solve(hessian + 1e-6 * np.eye(2), gradient)
+        params -= step
+        if np.abs(step).max() < 1e-9:
+            break
+    return params
+
+
+def confident_threshold(
+    scores: np.ndarray, is_expected: np.ndarray, descending: bool
+) -> float:
+    """Return least extreme threshold such that at least CONFIDENT_PRECISION of the
+    frames past it are of the expected class"""
+    order = np.argsort(-scores if descending else scores)
+    precision = np.cumsum(is_expected[order]) / np.arange(1, len(scores) + 1)
+    confident = np.flatnonzero(precision >= CONFIDENT_PRECISION)
+    if len(confident) == 0:
+        return 1.0 if descending else 0.0
+    return float(scores[order][confident[-1]])
+
+
+def best_threshold(scores: np.ndarray, is_commercial: np.ndarray) -> float:
+    candidates = np.unique(scores)
+    accuracies = [((scores >= t) == is_commercial).mean() for t in candidates]
+    return float(candidates[np.argmax(accuracies)])
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(f"USAGE: python3 {sys.argv[0]} /path/to/model.keras")
+        return
+
+    _, validation_dataset, _ = get_datasets()
+    model = keras.models.load_model(sys.argv[1])
+
+    outputs = []
+    labels = []
+    for images, batch_labels in tqdm(validation_dataset):
+        outputs.append(model.predict(images, verbose=0)[:, 0])
+        labels.append(batch_labels.numpy())
+    # classes are sorted alphabetically, so 0 is commercial and 1 is game
+    is_commercial = np.concatenate(labels) == 0
+    logits = commercial_logits(np.concatenate(outputs))
+
+    slope, intercept = fit_platt_scaling(logits, is_commercial.astype(float))
+    scores = sigmoid(slope * logits + intercept)
+
+    enter_threshold = float(np.quantile(scores[~is_commercial], 1 - MAX_WRONG_RATE))
+    exit_threshold = float(np.quantile(scores[is_commercial], MAX_WRONG_RATE))
+    if exit_threshold > enter_threshold:
+        # classes barely overlap, so one threshold works for both directions
+        enter_threshold = exit_threshold = best_threshold(scores, is_commercial)
+
+    confident_commercial = confident_threshold(scores, is_commercial, True)
+    confident_game = confident_threshold(scores, ~is_commercial, False)
+
+    accuracy = ((scores >= enter_threshold) == is_commercial).mean()
+    print(f"{len(scores)} validation images, {is_commercial.sum()} commercials.")
+    print(f"Accuracy at enter threshold: {round(accuracy * 100, 2)}%")
+    print(
+        f"{round((scores >= confident_commercial).mean() * 100, 2)}% of frames switch"
+        " away right away, and"
+        f" {round((scores <= confident_game).mean() * 100, 2)}% switch back right away."
+    )
+    print("\nPut these values in constants.py:\n")
+    print(f"COMMERCIAL_ENTER_THRESHOLD = {round(enter_threshold, 4)}")
+    print(f"COMMERCIAL_EXIT_THRESHOLD = {round(exit_threshold, 4)}")
+    print(f"SCORE_CALIBRATION = ({round(slope, 4)}, {round(intercept, 4)})")
+    print(f"CONFIDENT_COMMERCIAL_SCORE = {round(confident_commercial, 4)}")
+    print(f"CONFIDENT_GAME_SCORE = {round(confident_game, 4)}")
+
+
+if __name__ == "__main__":
+    main()
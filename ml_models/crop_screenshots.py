@@ -1,6 +1,8 @@
 import os
 import sys
+from typing import Sequence
 
+import numpy as np
 from PIL import Image, ImageDraw
 
 
@@ -15,12 +17,139 @@ class ImageCropper:
     """
 
     NUM_STEPS = 50
-
-    def __init__(self, image_path: str) -> None:
-        self.image_path = image_path
-        self.img = Image.open(self.image_path)
+    # an edge is where EDGE_MIN_COLORS different colors are found in EDGE_WINDOW
+    # consecutive pixels
+    EDGE_WINDOW = 10
+    EDGE_MIN_COLORS = 5
+    # number of pixels along each line to first look for edges in at once
+    SCAN_CHUNK = 64
+    # number of lines to look at when checking if previous crop points still apply
+    CHECK_STEPS = 5
+    # when checking previous crop points, the stream must still start within
+    # EDGE_CHECK_DEPTH pixels inside of each, compared to the border EDGE_CHECK_MARGIN
+    # pixels outside of them
+    EDGE_CHECK_DEPTH = 10
+    EDGE_CHECK_MARGIN = 3
+
+    def __init__(self, image: str | Image.Image) -> None:
+        """image can either be a path to an image file or an already loaded image
+        (e.g. a frame captured in memory by a CaptureBackend)
+        """
+        if isinstance(image, str):
+            self.image_path = image
+            self.img = Image.open(self.image_path)
+        else:
+            self.image_path = "captured frame"
+            self.img = image
         self.width, self.height = self.img.size
-        self.pixel_map = self.img.load()
+        self.num_channels = len(self.img.getbands())
+
+    def _get_pixels(self, rows: Sequence[int], columns: Sequence[int]) -> np.ndarray:
+        """Return pixels at given rows and columns as array indexed by [row, column],
+        with each pixel packed into one integer so that many pixels can be compared at
+        once. Only converts the part of the image that is needed to an array.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        if len(rows) == 0 or len(columns) == 0:
+            return np.zeros((len(rows), len(columns)), dtype=np.int64)
+
+        left, right = columns.min(), columns.max() + 1
+        if len(rows) * 4 < rows.max() - rows.min():
+            # rows are far apart, so only convert the rows that are needed
+            pixels = np.stack(
+                [
+                    np.asarray(self.img.crop((left, row, right, row + 1)))[0]
+                    for row in rows
+                ]
+            )[:, columns - left]
+        else:
+            top = rows.min()
+            region = np.asarray(self.img.crop((left, top, right, rows.max() + 1)))
+            pixels = region[np.ix_(rows - top, columns - left)]
+        if pixels.ndim == 3:
+            packed = np.zeros(pixels.shape[:2], dtype=np.int64)
+            for channel in range(pixels.shape[2]):
+                packed |= pixels[:, :, channel].astype(np.int64) << (8 * channel)
+            return packed
+        return pixels.astype(np.int64)
+
+    def _pack_colors(self, colors: list[tuple[int, int, int]]) -> np.ndarray:
+        """Pack RGB colors the same way as _get_pixels. Returns no colors if image
+        isn't RGB, since its pixels could never be equal to an RGB tuple"""
+        if self.num_channels != 3:
+            return np.array([], dtype=np.int64)
+        return np.array([r | (g << 8) | (b << 16) for r, g, b in colors])
+
+    def _scan_for_edges(
+        self, lines: Sequence[int], positions: Sequence[int], vertical: bool
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Walk along each given column (if vertical, otherwise row) of the image,
+        visiting pixels in the order given by positions. Returns, for each line,
+        whether an edge was found, the index in positions where the last EDGE_WINDOW
+        pixels first contain at least EDGE_MIN_COLORS different colors, the number
+        of pixels in that window, and the index in that window of the first pixel
+        different from the window's first pixel (i.e. where the edge starts).
+        """
+        lines = np.asarray(lines, dtype=np.int64)
+        num_lines = len(lines)
+        found = np.zeros(num_lines, dtype=bool)
+        edge_indices = np.zeros(num_lines, dtype=np.int64)
+        offsets = np.zeros(num_lines, dtype=np.int64)
+        # last EDGE_WINDOW - 1 pixels visited in each line
+        previous = np.zeros((num_lines, self.EDGE_WINDOW - 1), dtype=np.int64)
+
+        # edges are usually close to the window border, so only convert and look at
+        # a chunk of pixels at a time, for the lines where no edge has been found yet.
+        # Chunks get bigger the further from the border the scan goes
+        chunk_start = 0
+        chunk_size = self.SCAN_CHUNK
+        while chunk_start < len(positions):
+            remaining = np.flatnonzero(~found)
+            if len(remaining) == 0:
+                break
+
+            chunk_positions = positions[chunk_start : chunk_start + chunk_size]
+            if vertical:
+                chunk = self._get_pixels(chunk_positions, lines[remaining]).T
+            else:
+                chunk = self._get_pixels(lines[remaining], chunk_positions)
+
+            if chunk_start == 0:
+                # pad start of each line with copies of its first pixel so that every
+                # position has a full window. This doesn't change which colors are in
+                # the first windows, since those all contain the first pixel anyway
+                previous[:] = chunk[:, :1]
+            extended = np.concatenate((previous[remaining], chunk), axis=1)
+            previous[remaining] = extended[:, len(chunk_positions) :]
+
+            windows = np.lib.stride_tricks.sliding_window_view(
+                extended, self.EDGE_WINDOW, axis=1
+            )
+            sorted_windows = np.sort(windows, axis=2)
+            num_colors = 1 + np.count_nonzero(np.diff(sorted_windows, axis=2), axis=2)
+            edges = num_colors >= self.EDGE_MIN_COLORS
+
+            chunk_found = np.flatnonzero(edges.any(axis=1))
+            chunk_indices = np.argmax(edges[chunk_found], axis=1)
+            edge_windows = windows[chunk_found, chunk_indices]
+            new_lines = remaining[chunk_found]
+            found[new_lines] = True
+            edge_indices[new_lines] = chunk_start + chunk_indices
+            offsets[new_lines] = np.argmax(edge_windows != edge_windows[:, :1], axis=1)
+
+            chunk_start += chunk_size
+            chunk_size *= 2
+
+        # offsets must be relative to the unpadded window
+        offsets -= np.maximum(self.EDGE_WINDOW - 1 - edge_indices, 0)
+        window_lengths = np.minimum(edge_indices + 1, self.EDGE_WINDOW)
+
+        return found, edge_indices, window_lengths, offsets
+
+    @staticmethod
+    def _most_common(lines: list[int]) -> int:
+        return max(set(lines), key=lines.count)
 
     def find_top_bottom_edge(self, edge_type: str) -> int:
         if edge_type == "top":
@@ -33,36 +162,21 @@ class ImageCropper:
         else:
             return 0
 
-        if self.pixel_map is None:
-            raise Exception("self.pixel_map is None")
-
-        lines = []
-        for column in range(
+        columns = range(
             start_pixel[0],
             self.width // 2,
             -1 * (start_pixel[0] - self.width // 2) // self.NUM_STEPS,
-        ):
-            last_ten_pixels = []
-            edge_start = 0
-            for row in range(start_pixel[1], self.height // 2, increment):
-                if len(last_ten_pixels) < 10:
-                    last_ten_pixels.append(self.pixel_map[column, row])
-                else:
-                    del last_ten_pixels[0]
-                    last_ten_pixels.append(self.pixel_map[column, row])
-                if len(set(last_ten_pixels)) >= 5:
-                    edge_offset = 0
-                    for index, pixel in enumerate(last_ten_pixels):
-                        if pixel != last_ten_pixels[0]:
-                            edge_offset = index
-                            break
-                    edge_start = row - increment * (10 - edge_offset)
-                    lines.append(edge_start)
-                    break
+        )
+        rows = range(start_pixel[1], self.height // 2, increment)
+        found, positions, _, offsets = self._scan_for_edges(columns, rows, True)
+        edge_starts = start_pixel[1] + increment * (
+            positions - (self.EDGE_WINDOW - offsets)
+        )
+        lines = [int(edge_start) for edge_start in edge_starts[found]]
 
         if len(lines) == 0:
             raise Exception(f"{edge_type} edge of {self.image_path} not found.")
-        return max(set(lines), key=lines.count)
+        return self._most_common(lines)
 
     def find_left_right_edge(
         self, edge_type: str, top_bottom: tuple[int, int] | None = None
@@ -83,38 +197,23 @@ class ImageCropper:
         else:
             top, bottom = top_bottom
 
-        if self.pixel_map is None:
-            raise Exception("self.pixel_map is None")
-
-        lines = []
-        for row in range(
+        rows = range(
             top,
             bottom,
             (bottom - top) // self.NUM_STEPS,
-        ):
-            last_ten_pixels = []
-            edge_start = 0
-            for column in range(start_pixel[0], self.width // 2, increment):
-                if len(last_ten_pixels) < 10:
-                    last_ten_pixels.append(self.pixel_map[column, row])
-                else:
-                    del last_ten_pixels[0]
-                    last_ten_pixels.append(self.pixel_map[column, row])
-                if len(set(last_ten_pixels)) >= 5:
-                    edge_offset = 0
-                    for index, pixel in enumerate(last_ten_pixels):
-                        if pixel != last_ten_pixels[0]:
-                            edge_offset = index
-                            break
-                    edge_start = column - increment * (
-                        len(last_ten_pixels) - edge_offset
-                    )
-                    lines.append(edge_start)
-                    break
+        )
+        columns = range(start_pixel[0], self.width // 2, increment)
+        found, positions, window_lengths, offsets = self._scan_for_edges(
+            rows, columns, False
+        )
+        edge_starts = start_pixel[0] + increment * (
+            positions - (window_lengths - offsets)
+        )
+        lines = [int(edge_start) for edge_start in edge_starts[found]]
 
         if len(lines) == 0:
             raise Exception(f"{edge_type} edge of {self.image_path} not found.")
-        return max(set(lines), key=lines.count)
+        return self._most_common(lines)
 
     def find_training_image_edge(self, edge_type: str) -> int:
         """Use (relatively) simpler heuristic to crop training images: remove all
@@ -131,9 +230,6 @@ class ImageCropper:
         else:
             return 0
 
-        if self.pixel_map is None:
-            raise Exception("self.pixel_map is None")
-
         address_bar_colors = [
             (40, 40, 40),  # address bar when not focused
             (49, 49, 49),  # address bar when focused
@@ -144,34 +240,36 @@ class ImageCropper:
             (34, 34, 34),  # space below stream from something else
             (0, 0, 0),  # just black, sometimes black bars above and below stream
         ]
-        address_bar_lines = []
-        lines = []
-        for column in range(
+        columns = range(
             start_pixel[0],
             (3 * self.width) // 4,
             -1 * (start_pixel[0] - ((3 * self.width) // 4)) // self.NUM_STEPS,
-        ):
-            address_bar_found = False
-            for row in range(start_pixel[1], self.height // 2, increment):
-                if not address_bar_found and edge_type == "top":
-                    if self.pixel_map[column, row] not in address_bar_colors:
-                        address_bar_lines.append(row)
-                        address_bar_found = True
-                if (
-                    self.pixel_map[column, row]
-                    not in address_bar_colors + other_window_colors
-                ):
-                    lines.append(row)
-                    break
+        )
+        rows = np.arange(start_pixel[1], self.height // 2, increment)
+        lines_pixels = self._get_pixels(rows, columns).T
+
+        # first row in each column that is not a known window color
+        new_color = ~np.isin(
+            lines_pixels,
+            self._pack_colors(address_bar_colors + other_window_colors),
+        )
+        lines = [int(rows[np.argmax(line)]) for line in new_color if line.any()]
 
         if len(lines) > 0:
-            return max(set(lines), key=lines.count)
+            return self._most_common(lines)
         else:
             if edge_type == "bottom":
                 return self.height - 1
+            # first row in each column that is not part of the address bar
+            not_address_bar = ~np.isin(
+                lines_pixels, self._pack_colors(address_bar_colors)
+            )
+            address_bar_lines = [
+                int(rows[np.argmax(line)]) for line in not_address_bar if line.any()
+            ]
             if len(address_bar_lines) > 0:
                 # fall back to just removing address bar if no new color found
-                return max(set(address_bar_lines), key=address_bar_lines.count)
+                return self._most_common(address_bar_lines)
             else:
                 raise Exception(f"{edge_type} edge of {self.image_path} not found.")
 
@@ -194,6 +292,95 @@ class ImageCropper:
 
         return top, bottom, left, right
 
+    def borders_unchanged(self, crop_points: tuple[int, int, int, int]) -> bool:
+        """Cheap check of whether crop points found in a previous screenshot of the
+        same window still apply: the borders outside of them must still be plain,
+        i.e. no edge can be found in them along a few lines, and the stream must still
+        start right inside of each of them (see edges_unchanged).
+        """
+        top, bottom, left, right = crop_points
+        columns = range(
+            self.width - 50,
+            self.width // 2,
+            min(-1 * (self.width - 50 - self.width // 2) // self.CHECK_STEPS, -1),
+        )
+        rows = range(top, bottom, max((bottom - top) // self.CHECK_STEPS, 1))
+        border_scans = [
+            (columns, range(20, top), True),
+            (columns, range(self.height - 20, bottom, -1), True),
+            (rows, range(0, left), False),
+            (rows, range(self.width - 1, right, -1), False),
+        ]
+
+        for lines, positions, vertical in border_scans:
+            found, _, _, _ = self._scan_for_edges(lines, positions, vertical)
+            if found.any():
+                return False
+        return self.edges_unchanged(crop_points)
+
+    def edges_unchanged(self, crop_points: tuple[int, int, int, int]) -> bool:
+        """Whether the stream still starts at each of the crop points, i.e. along a
+        few lines between the other crop points, one of the pixels just inside of the
+        crop point differs from all border colors found just outside of the crop
+        points. Crop points at the edge of the image have nothing outside of them, so
+        are only compared to the other borders' colors.
+        """
+        top, bottom, left, right = crop_points
+        margin, depth = self.EDGE_CHECK_MARGIN, self.EDGE_CHECK_DEPTH
+        # stay clear of the corners, where lines could still be part of the border
+        columns = range(
+            left + margin + depth,
+            right - margin - depth,
+            max((right - left) // self.CHECK_STEPS, 1),
+        )
+        rows = range(
+            top + margin + depth,
+            bottom - margin - depth,
+            max((bottom - top) // self.CHECK_STEPS, 1),
+        )
+        # lines, position outside of crop point, positions inside of it, and whether
+        # lines are columns
+        edges = [
+            (columns, top - margin, range(top + margin, top + margin + depth), True),
+            (
+                columns,
+                bottom + margin,
+                range(bottom - margin, bottom - margin - depth, -1),
+                True,
+            ),
+            (rows, left - margin, range(left + margin, left + margin + depth), False),
+            (
+                rows,
+                right + margin,
+                range(right - margin, right - margin - depth, -1),
+                False,
+            ),
+        ]
+
+        border_colors = []
+        for lines, outside, _, vertical in edges:
+            if 0 <= outside < (self.height if vertical else self.width):
+                if vertical:
+                    border_colors.append(self._get_pixels([outside], lines).ravel())
+                else:
+                    border_colors.append(self._get_pixels(lines, [outside]).ravel())
+        if len(border_colors) == 0:
+            # stream fills whole image, so there is nothing to compare to
+            return True
+        border_colors = np.unique(np.concatenate(border_colors))
+
+        for lines, _, inside, vertical in edges:
+            size = self.height if vertical else self.width
+            inside = [position for position in inside if 0 <= position < size]
+            if vertical:
+                pixels = self._get_pixels(inside, lines).T
+            else:
+                pixels = self._get_pixels(lines, inside)
+            # indexed by [line, position]
+            if not (~np.isin(pixels, border_colors)).any(axis=1).all():
+                return False
+        return True
+
     def view_crop(self, training: bool = False, crop_left_right: bool = True) -> None:
         top, bottom, left, right = self.get_crop_points(training, crop_left_right)
 
@@ -211,13 +398,17 @@ class ImageCropper:
         training: bool = False,
         crop_left_right: bool = True,
         resize_dims: tuple[int, int] | None = None,
+        crop_points: tuple[int, int, int, int] | None = None,
     ) -> Image.Image:
         """NOTE: resize_dims must be of the form (width, height). training=True
         uses simpler algorithm to crop images by matching border colors and removing
         them. May not work for input images with different background colors depending
-        on website/fullscreening browser extension.
+        on website/fullscreening browser extension. Pass crop_points (as returned by
+        get_crop_points) to skip finding them again.
         """
-        top, bottom, left, right = self.get_crop_points(training, crop_left_right)
+        if crop_points is None:
+            crop_points = self.get_crop_points(training, crop_left_right)
+        top, bottom, left, right = crop_points
 
         if bottom - top < self.height // 4 or right - left < self.width // 4:
             print(
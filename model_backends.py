@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+
+class KerasModel:
+    """Run classifier from a .keras file with Keras/TensorFlow"""
+
+    def __init__(self, model_file_path: str) -> None:
+        print(
+            "Importing Python machine learning libraries, this may take a few seconds..."
+        )
+        import keras
+
+        self.model = keras.models.load_model(model_file_path)
+
+    def predict(self, img_arr: np.ndarray) -> np.ndarray:
+        return self.model.predict(img_arr, verbose=0)
+
+
+class TFLiteModel:
+    """Run classifier from a .tflite file (see export_model.py) with the standalone
+    LiteRT/TFLite interpreter, which starts much faster and uses much less memory
+    than importing TensorFlow
+    """
+
+    def __init__(self, model_file_path: str) -> None:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                print(
+                    "No standalone TFLite interpreter installed, falling back to"
+                    " TensorFlow's. This may take a few seconds..."
+                )
+                from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(
+            model_path=model_file_path, num_threads=os.cpu_count()
+        )
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+
+    def predict(self, img_arr: np.ndarray) -> np.ndarray:
+        # interpreter has a fixed batch size, so resize it when batch size changes
+        input_shape = self.interpreter.get_input_details()[0]["shape"]
+        if tuple(input_shape) != img_arr.shape:
+            self.interpreter.resize_tensor_input(self.input_index, img_arr.shape)
+            self.interpreter.allocate_tensors()
+
+        self.interpreter.set_tensor(self.input_index, img_arr.astype(np.float32))
+        self.interpreter.invoke()
+
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def load_model(model_file_path: str) -> KerasModel | TFLiteModel:
+    if os.path.splitext(model_file_path)[1] == ".tflite":
+        return TFLiteModel(model_file_path)
+    return KerasModel(model_file_path)
@@ -0,0 +1,384 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Callable
+
+import tracing
+from actuators import WindowActuator
+from capture import FileCaptureBackend
+from classifier import Classifier, FrameCache
+from constants import (
+    COMMERCIAL_CLASS,
+    CONFIRM_UPDATE_RATE,
+    DEFAULT_UPDATE_RATE,
+    FILE_EXTENSION,
+    GAME_CLASS,
+    INFERENCE_BUDGET,
+    MODEL_FILE_PATH,
+    SORTED_DATA_DIRECTORY,
+)
+from manage_streams import StreamManager
+
+"""
+Replay screenshots taken by ScreenshotTaker (e.g. with main.py -t) through
+StreamManager's decision logic faster than real time, with windows and audio replaced
+by stubs, and compare when it switches away from/back to the main stream against the
+labels of the screenshots (added by label_screenshots.py). Reports detection delay,
+false switches and time spent muted, so changes to the classifier or switching logic
+can be evaluated without a Mac, a browser or a live game.
+
+Each window is assumed to keep showing its latest screenshot until its next one, so
+delays can't be measured more precisely than the interval between screenshots.
+
+Run with python3 replay.py -d sorted_screenshots -c ml_models/part5_cropped_5-29-24.keras
+"""
+
+# e.g. 24-05-29_20-15-03_1234_game.jpg
+SCREENSHOT_PATTERN = re.compile(
+    r"^(\d{2}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})_(\d+)"
+    rf"(?:_({GAME_CLASS}|{COMMERCIAL_CLASS}))?\.{FILE_EXTENSION}$"
+)
+
+
+def load_recording(directory: str) -> dict[int, list[tuple[float, str, bool | None]]]:
+    """Return screenshots in directory (including subdirectories) by window ID, as
+    lists of timestamp, file path and whether screenshot is labeled as a commercial
+    (None if unlabeled) sorted by timestamp"""
+    recording: dict[int, list[tuple[float, str, bool | None]]] = {}
+    for path, _, files in os.walk(directory):
+        for filename in files:
+            match = SCREENSHOT_PATTERN.match(filename)
+            if match is None:
+                continue
+
+            date_str, win_id, label = match.groups()
+            # label_screenshots.py also sorts labeled screenshots into directories
+            if label is None and os.path.basename(path) in [
+                GAME_CLASS,
+                COMMERCIAL_CLASS,
+            ]:
+                label = os.path.basename(path)
+            is_commercial = None if label is None else label == COMMERCIAL_CLASS
+
+            timestamp = datetime.strptime(date_str, "%y-%m-%d_%H-%M-%S").timestamp()
+            recording.setdefault(int(win_id), []).append(
+                (timestamp, os.path.join(path, filename), is_commercial)
+            )
+
+    for frames in recording.values():
+        frames.sort()
+
+    return recording
+
+
+class ReplayActuator(WindowActuator):
+    """Keeps track of what StreamManager does to the windows instead of doing it"""
+
+    def __init__(self, win_ids: list[int], main_id: int) -> None:
+        self.win_ids = win_ids
+        self.focused_id = main_id
+        self.fullscreen = False
+        self.muted = {win_id: win_id != main_id for win_id in win_ids}
+        self.covered_id: int | None = None
+
+    def get_windows(self) -> list[dict]:
+        return [
+            {
+                "id": win_id,
+                "focus": win_id == self.focused_id,
+                "fullscreen": self.fullscreen,
+            }
+            for win_id in self.win_ids
+        ]
+
+    def set_muted(self, win_id: int, mute: bool = True) -> None:
+        self.muted[win_id] = mute
+
+    def focus(self, win_id: int) -> None:
+        self.focused_id = win_id
+        if win_id != self.covered_id:
+            self.covered_id = None
+
+    def cover(self, win_id: int, cover_id: int) -> None:
+        self.covered_id = win_id
+
+    def toggle_fullscreen(self, win_id: int) -> None:
+        # windows are either all fullscreen or all tiled
+        self.fullscreen = not self.fullscreen
+
+
+class ReplayStreamManager(StreamManager):
+    """StreamManager that runs on recorded screenshots and a virtual clock instead of
+    live windows, without doing any of the setup that needs yabai or a browser"""
+
+    def __init__(
+        self,
+        recording: dict[int, list[tuple[float, str, bool | None]]],
+        main_id: int,
+        classifier_path: str = MODEL_FILE_PATH,
+        update_rate: int = DEFAULT_UPDATE_RATE,
+        inference_budget: float = INFERENCE_BUDGET,
+    ) -> None:
+        self.recording = recording
+        self.now = max(frames[0][0] for frames in recording.values())
+        self.capture_backend = FileCaptureBackend()
+        self.classifier = Classifier(
+            classifier_path,
+            capture_backend=self.capture_backend,
+            frame_cache=FrameCache(clock=lambda: self.now),
+        )
+        self.space = 0
+        self.cover_id = None
+        self.id_dict = {win_id: win_id for win_id in recording}
+        self.actuator = ReplayActuator(list(recording), main_id)
+        # background scorer runs between ticks instead of in a thread, to follow
+        # virtual clock
+        self._init_state(
+            main_id,
+            {win_id: str(win_id) for win_id in recording},
+            update_rate,
+            inference_budget,
+            clock=lambda: self.now,
+        )
+
+    def __del__(self) -> None:
+        if hasattr(self, "classifier"):
+            self.classifier.__del__()
+
+        if hasattr(self, "action_queue"):
+            self.action_queue.close()
+
+        if hasattr(self, "inference_executor"):
+            self.inference_executor.shutdown(wait=False)
+
+    def show_frames(self) -> bool | None:
+        """Make each window show its latest screenshot at current virtual time, and
+        return label of the main window's"""
+        main_label = None
+        for win_id, frames in self.recording.items():
+            latest = [frame for frame in frames if frame[0] <= self.now][-1]
+            self.capture_backend.set_frame(win_id, latest[1])
+            if win_id == self.main_id:
+                main_label = latest[2]
+        return main_label
+
+    async def run_blocking(self, func: Callable, *args) -> Any:
+        # nothing else happens during a replay tick, so no need for another thread
+        return func(*args)
+
+    def tick(self) -> None:
+        if self.background_scorer.due():
+            self.background_scorer.score_now()
+        self.loop.run_until_complete(self.handle_if_main_commercial())
+
+    def replay(self, verbose: bool = False) -> dict:
+        """Run main loop until the main window's last screenshot and return how its
+        switches compare to the labels"""
+        end = self.recording[self.main_id][-1][0]
+        stats = {
+            "duration": 0.0,
+            "commercial_time": 0.0,
+            "game_time": 0.0,
+            "muted_during_commercial": 0.0,
+            "muted_during_game": 0.0,
+            "unmuted_during_commercial": 0.0,
+            "switches_away": 0,
+            "false_switches_away": 0,
+            "returns": 0,
+            "false_returns": 0,
+            "missed_commercials": 0,
+            "missed_returns": 0,
+            "ticks": 0,
+        }
+        switch_away_delays: list[float] = []
+        return_delays: list[float] = []
+
+        prev_label = self.show_frames()
+        # time since which main window's label differs from the switching state
+        disagree_since: float | None = None
+        while self.now <= end:
+            was_muted = self.actuator.muted[self.main_id]
+            label = self.show_frames()
+            if label is not None and label != prev_label and prev_label is not None:
+                if disagree_since is not None:
+                    # label changed back before switch caught up with it
+                    if prev_label:
+                        stats["missed_commercials"] += 1
+                    else:
+                        stats["missed_returns"] += 1
+                    disagree_since = None
+                elif label != was_muted:
+                    # count delay from time the screenshot was taken
+                    disagree_since = [
+                        frame[0]
+                        for frame in self.recording[self.main_id]
+                        if frame[0] <= self.now
+                    ][-1]
+            if label is not None:
+                prev_label = label
+
+            with tracing.span("tick", replay_time=self.now):
+                if verbose:
+                    self.tick()
+                else:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        self.tick()
+            stats["ticks"] += 1
+
+            is_muted = self.actuator.muted[self.main_id]
+            if is_muted != was_muted:
+                key = "switches_away" if is_muted else "returns"
+                stats[key] += 1
+                if label is not None and label != is_muted:
+                    stats[f"false_{key}"] += 1
+                if disagree_since is not None and label == is_muted:
+                    delays = switch_away_delays if is_muted else return_delays
+                    delays.append(self.now - disagree_since)
+                    disagree_since = None
+
+            tracker = self.trackers.get(self.main_id)
+            if tracker is not None and tracker.pending:
+                self.background_scorer.request_soon()
+                step = CONFIRM_UPDATE_RATE
+            else:
+                step = self.update_rate
+            # main window is in this state until next tick or end of recording
+            span = min(step, end - self.now)
+
+            stats["duration"] += span
+            if label is not None:
+                stats["commercial_time" if label else "game_time"] += span
+                if is_muted:
+                    stats[
+                        "muted_during_commercial" if label else "muted_during_game"
+                    ] += span
+                elif label:
+                    stats["unmuted_during_commercial"] += span
+            self.now += step
+
+        for name, delays in [
+            ("switch_away_delay", switch_away_delays),
+            ("return_delay", return_delays),
+        ]:
+            stats[f"mean_{name}"] = (
+                round(sum(delays) / len(delays), 2) if len(delays) > 0 else None
+            )
+            stats[f"max_{name}"] = max(delays) if len(delays) > 0 else None
+        stats["model_runs"] = sum(self.classifier.frame_cache.misses.values())
+
+        return stats
+
+
+def print_stats(stats: dict) -> None:
+    def minutes(seconds: float) -> str:
+        return f"{round(seconds / 60, 1)} min"
+
+    print(
+        f"\nReplayed {minutes(stats['duration'])} of main stream in"
+        f" {stats['ticks']} ticks ({stats['model_runs']} model runs)."
+    )
+    print(
+        f"Labeled {minutes(stats['commercial_time'])} commercials and"
+        f" {minutes(stats['game_time'])} game."
+    )
+    print(
+        f"Muted during {minutes(stats['muted_during_commercial'])} of commercials,"
+        f" missed {minutes(stats['unmuted_during_commercial'])} of commercials,"
+        f" and muted during {minutes(stats['muted_during_game'])} of game."
+    )
+    print(
+        f"Switched away {stats['switches_away']} times"
+        f" ({stats['false_switches_away']} during game), mean delay"
+        f" {stats['mean_switch_away_delay']}s, max {stats['max_switch_away_delay']}s,"
+        f" {stats['missed_commercials']} commercials missed entirely."
+    )
+    print(
+        f"Returned {stats['returns']} times"
+        f" ({stats['false_returns']} during commercials), mean delay"
+        f" {stats['mean_return_delay']}s, max {stats['max_return_delay']}s,"
+        f" {stats['missed_returns']} returns missed entirely."
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay recorded screenshots through the stream switching logic"
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=SORTED_DATA_DIRECTORY,
+        help="Directory of screenshots taken by take_screenshots.py",
+    )
+    parser.add_argument(
+        "-c",
+        "--path-to-classifier",
+        default=MODEL_FILE_PATH,
+        help="Path to classifier .keras or .tflite file",
+    )
+    parser.add_argument(
+        "-m",
+        "--main-window",
+        type=int,
+        help="ID of window to treat as main stream (default: one with most screenshots)",
+    )
+    parser.add_argument(
+        "-u",
+        "--update-rate",
+        type=int,
+        default=DEFAULT_UPDATE_RATE,
+        help="Seconds between checks of main stream",
+    )
+    parser.add_argument(
+        "-b",
+        "--inference-budget",
+        type=float,
+        default=INFERENCE_BUDGET,
+        help="Frames per second that may be classified across all windows",
+    )
+    parser.add_argument("-o", "--output", help="Path of JSON file to save results to")
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Write timed spans of each tick to FILE (see trace_summary.py)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show StreamManager output"
+    )
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
+    recording = load_recording(args.directory)
+    if len(recording) == 0:
+        raise Exception(f"No screenshots found in {args.directory}")
+
+    main_id = args.main_window
+    if main_id is None:
+        main_id = max(recording, key=lambda win_id: len(recording[win_id]))
+    elif main_id not in recording:
+        raise Exception(f"No screenshots of window {main_id} in {args.directory}")
+
+    manager = ReplayStreamManager(
+        recording,
+        main_id,
+        args.path_to_classifier,
+        args.update_rate,
+        args.inference_budget,
+    )
+    stats = manager.replay(verbose=args.verbose)
+    print_stats(stats)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Callable, Coroutine
+
+import metrics
+from constants import SIGNAL_MAX_DELAY, SIGNAL_QUIET_SECONDS
+
+
+class SignalIntake:
+    """Queues events from yabai signals, which call the server once per event (e.g.
+    once per window when several windows are resized at once), and handles each burst
+    of them together from one task on the event loop. A burst lasts until no event
+    arrived for quiet seconds (or max_delay seconds passed since its first event).
+    Within a burst, events of the same signal and window are merged into the latest one,
+    and each remaining event is handled once. All methods must be called from the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        quiet: float = SIGNAL_QUIET_SECONDS,
+        max_delay: float = SIGNAL_MAX_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.clock = clock
+        # keys: signal names, values: handler, seconds to drop new events of the
+        # signal for after handling one, and whether only the latest window matters
+        self.handlers: dict[str, tuple[Callable[[int], Coroutine], float, bool]] = {}
+        # keys: signal name and window ID of events in current burst, in the order
+        # they will be handled (latest event last)
+        self.pending: dict[tuple[str, int], None] = {}
+        self.burst_start: float | None = None
+        self.last_event: float | None = None
+        # keys: signal names, values: time until which new events are dropped
+        self.settle_until: dict[str, float] = {}
+        self.changed = asyncio.Event()
+        # keys: signal names, values: number of events received, merged and dropped
+        self.received: dict[str, int] = {}
+        self.merged: dict[str, int] = {}
+        self.dropped: dict[str, int] = {}
+
+    def register(
+        self,
+        signal: str,
+        handler: Callable[[int], Coroutine],
+        settle: float = 0,
+        latest_only: bool = False,
+    ) -> None:
+        """Handle events of signal by awaiting handler with the window ID, which returns
+        why the event was ignored (or None if it wasn't). Events that arrive while one
+        is handled and for settle seconds after (e.g. ones caused by handling it) are
+        dropped. If latest_only is True, only the latest window's event of a burst is
+        handled (e.g. for focus, where only the window focused last matters)."""
+        self.handlers[signal] = (handler, settle, latest_only)
+
+    def submit(self, signal: str, win_id: int) -> None:
+        """Queue event to be handled with the rest of its burst"""
+        if signal not in self.handlers:
+            raise Exception(f'No handler registered for signal "{signal}"')
+        _, _, latest_only = self.handlers[signal]
+        now = self.clock()
+        self.received[signal] = self.received.get(signal, 0) + 1
+
+        if now < self.settle_until.get(signal, 0):
+            self._drop(signal, "settling")
+            return
+
+        if latest_only:
+            merged_keys = [key for key in self.pending if key[0] == signal]
+        else:
+            merged_keys = [key for key in self.pending if key == (signal, win_id)]
+        for key in merged_keys:
+            del self.pending[key]
+            self.merged[signal] = self.merged.get(signal, 0) + 1
+            metrics.merged_signal_events.inc(signal=signal)
+
+        self.pending[(signal, win_id)] = None
+        if self.burst_start is None:
+            self.burst_start = now
+        self.last_event = now
+        self.changed.set()
+
+    def _drop(self, signal: str, reason: str) -> None:
+        self.dropped[signal] = self.dropped.get(signal, 0) + 1
+        metrics.dropped_signal_events.inc(signal=signal, reason=reason)
+
+    async def run(self) -> None:
+        """Handle bursts of events as they end, forever"""
+        while True:
+            self.changed.clear()
+            if self.burst_start is None:
+                await self.changed.wait()
+                continue
+
+            burst_end = min(
+                self.last_event + self.quiet, self.burst_start + self.max_delay
+            )
+            timeout = burst_end - self.clock()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            events = list(self.pending)
+            self.pending.clear()
+            self.burst_start = None
+            self.last_event = None
+            for signal, win_id in events:
+                await self._handle(signal, win_id)
+
+    async def _handle(self, signal: str, win_id: int) -> None:
+        handler, settle, _ = self.handlers[signal]
+        previous_settle_until = self.settle_until.get(signal, 0)
+        if settle > 0:
+            self.settle_until[signal] = float("inf")
+
+        try:
+            reason = await handler(win_id)
+        except Exception as e:
+            print(f'Error handling "{signal}" signal of window {win_id}: {e}')
+            reason = "error"
+
+        if reason is None:
+            if settle > 0:
+                self.settle_until[signal] = self.clock() + settle
+        else:
+            self.settle_until[signal] = previous_settle_until
+            self._drop(signal, reason)
+
+    def summary(self) -> str:
+        if len(self.received) == 0:
+            return "No yabai signals received."
+        return "Yabai signals: " + ", ".join(
+            f"{signal}: {received} received, {self.merged.get(signal, 0)} merged,"
+            f" {self.dropped.get(signal, 0)} dropped"
+            for signal, received in self.received.items()
+        )
@@ -0,0 +1,55 @@
+import json
+import queue
+from threading import Lock
+from typing import Iterator
+
+from constants import STATE_STREAM_HEARTBEAT
+
+
+class StateStream:
+    """Pushes the state of StreamManager to every connected remote as Server-Sent
+    Events, so that remotes show what actually happened (and stay in sync with each
+    other) instead of guessing from their own requests. Remotes that fall behind only
+    get the latest state.
+    """
+
+    def __init__(self, heartbeat: float = STATE_STREAM_HEARTBEAT) -> None:
+        self.heartbeat = heartbeat
+        self.lock = Lock()
+        # one queue holding the latest unsent message per connected remote
+        self.subscribers: set[queue.Queue] = set()
+        self.latest: str | None = None
+
+    def publish(self, state: dict) -> None:
+        message = json.dumps(state)
+        with self.lock:
+            self.latest = message
+            for subscriber in self.subscribers:
+                # replace message remote hasn't received yet
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(message)
+
+    def events(self) -> Iterator[str]:
+        """Yield latest state and then each new one as Server-Sent Events, until
+        remote disconnects (for a streamed Flask response)"""
+        subscriber = queue.Queue(maxsize=1)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.latest is not None:
+                subscriber.put_nowait(self.latest)
+
+        try:
+            while True:
+                try:
+                    message = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # comment line, so that connection isn't closed for being idle
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
@@ -1,8 +1,14 @@
 const halftime_button = document.getElementById("halftime-button");
 const commercial_button = document.getElementById("commercial-button");
 const nba_button = document.getElementById("nba-button");
-let prev_commercial_val = null;
-let prev_nba_val = null;
+const connection_text = document.getElementById("connection-text");
+const main_text = document.getElementById("main-text");
+const window_list = document.getElementById("window-list");
+
+// latest state pushed by server, and when it was received (timers count down from
+// then)
+let state = null;
+let state_received = 0;
 
 async function make_fetch(endpoint) {
   const response = await fetch(endpoint, {
@@ -16,70 +22,110 @@ async function make_fetch(endpoint) {
   return response_obj;
 }
 
-async function force_halftime() {
-  const response_obj = await make_fetch("/force-halftime");
-  halftime_button.disabled = true;
-  commercial_button.disabled = true;
-
-  if (prev_commercial_val !== null) {
-    commercial_button.textContent = prev_commercial_val;
-    prev_commercial_val = null;
-  }
-
-  if (prev_nba_val !== null) {
-    nba_button.textContent = prev_nba_val;
-    prev_nba_val = null;
+function seconds_left(timer_name) {
+  if (state === null || !state.timers.hasOwnProperty(timer_name)) {
+    return null;
   }
+  const elapsed = (Date.now() - state_received) / 1000;
+  return Math.max(state.timers[timer_name] - elapsed, 0);
+}
 
-  // disable halftime button and commercial button until halftime is over
-  if (response_obj.hasOwnProperty("timeout")) {
-    setTimeout(() => {
-      halftime_button.disabled = false;
-      commercial_button.disabled = false;
-    }, response_obj["timeout"] * 1000);
+function with_countdown(text, timer_name) {
+  const seconds = seconds_left(timer_name);
+  if (seconds === null) {
+    return text;
   }
+  const minutes = Math.floor(seconds / 60);
+  const rest = String(Math.floor(seconds % 60)).padStart(2, "0");
+  return `${text} (${minutes}:${rest})`;
 }
 
-async function force_commercial() {
-  const response_obj = await make_fetch("/force-commercial");
+function render_buttons() {
+  halftime_button.textContent = state.halftime
+    ? with_countdown("Stop halftime", "halftime")
+    : "Start halftime";
 
-  if (prev_commercial_val === null) {
-    if (prev_nba_val !== null) {
-      nba_button.textContent = prev_nba_val;
-      prev_nba_val = null;
-    }
-    prev_commercial_val = commercial_button.textContent;
-  } else if (prev_commercial_val !== null) {
-    prev_commercial_val = null;
-  }
+  // halftime forces commercial by itself
+  commercial_button.disabled = state.halftime;
+  commercial_button.textContent =
+    state.forced === true && !state.halftime
+      ? with_countdown("Stop forcing commercial", "force-commercial")
+      : "Force commercial";
 
-  commercial_button.textContent = response_obj.next_action;
+  nba_button.textContent =
+    state.forced === false ? "Stop forcing NBA" : "Force NBA";
 }
 
-async function force_nba() {
-  const response_obj = await make_fetch("/force-nba");
+function render_windows() {
+  let main_status = state.commercial ? "commercial" : "game";
+  if (state.forced !== null) {
+    main_status += " (forced)";
+  }
+  main_text.textContent = `${state.titles[state.main_id]}: ${main_status}`;
 
-  if (prev_nba_val === null) {
-    if (prev_commercial_val !== null) {
-      commercial_button.textContent = prev_commercial_val;
-      prev_commercial_val = null;
+  window_list.replaceChildren();
+  for (const [win_id, title] of Object.entries(state.titles)) {
+    let text = title;
+    if (state.scores.hasOwnProperty(win_id)) {
+      text += `: ${Math.round(state.scores[win_id] * 100)}% commercial`;
+    }
+    if (Number(win_id) === state.main_id) {
+      text += " (main)";
+    } else if (Number(win_id) === state.focused_id) {
+      text += " (watching)";
+    }
+    if (state.snoozed.includes(Number(win_id))) {
+      text += " " + with_countdown("snoozed", `snooze-${win_id}`);
     }
-    prev_nba_val = nba_button.textContent;
-  } else if (prev_nba_val !== null) {
-    prev_nba_val = null;
+
+    const item = document.createElement("li");
+    item.textContent = text;
+    window_list.appendChild(item);
   }
+}
+
+function render() {
+  if (state === null) {
+    return;
+  }
+  render_buttons();
+  render_windows();
+}
 
-  nba_button.textContent = response_obj.next_action;
+function connect() {
+  // browser reconnects by itself if connection is lost
+  const events = new EventSource("/events");
+  events.onopen = () => {
+    connection_text.textContent = "";
+  };
+  events.onmessage = (e) => {
+    state = JSON.parse(e.data);
+    state_received = Date.now();
+    render();
+  };
+  events.onerror = () => {
+    connection_text.textContent = "Disconnected, reconnecting...";
+  };
 }
 
 window.onload = () => {
+  // buttons only send requests, and the page updates once the server pushes the
+  // resulting state
   halftime_button.onclick = async () => {
-    await force_halftime();
+    if (state !== null && state.halftime) {
+      await make_fetch("/timers/halftime/cancel");
+    } else {
+      await make_fetch("/force-halftime");
+    }
   };
   commercial_button.onclick = async () => {
-    await force_commercial(commercial_button);
+    await make_fetch("/force-commercial");
   };
   nba_button.onclick = async () => {
-    await force_nba(nba_button);
+    await make_fetch("/force-nba");
   };
+
+  connect();
+  // count down timers between pushes
+  setInterval(render, 1000);
 };
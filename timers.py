@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Coroutine
+
+
+class TimerService:
+    """Runs callbacks after given delays from one task on the event loop, keeping the
+    deadlines in a heap, instead of one sleeping thread per timer. Timers have names, so
+    they can be cancelled, extended and listed with their remaining time (e.g. for the
+    remote). All methods must be called from the event loop.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        # deadline, sequence number and name of each timer. Cancelled and extended
+        # timers leave their old entry behind, which is skipped once it comes up
+        self.heap: list[tuple[float, int, str]] = []
+        self.sequence_numbers = itertools.count()
+        # keys: names of active timers, values: deadline, sequence number of heap entry
+        # and callback
+        self.timers: dict[str, tuple[float, int, Callable[[], Coroutine]]] = {}
+        self.changed = asyncio.Event()
+        # callbacks that are running, so that they aren't garbage collected before
+        # they're done
+        self.running: set[asyncio.Task] = set()
+
+    def schedule(
+        self, name: str, delay: float, callback: Callable[[], Coroutine]
+    ) -> None:
+        """Await callback in delay seconds, replacing active timer with the same name
+        (if any)"""
+        self._push(name, self.clock() + delay, callback)
+
+    def _push(
+        self, name: str, deadline: float, callback: Callable[[], Coroutine]
+    ) -> None:
+        sequence_number = next(self.sequence_numbers)
+        self.timers[name] = (deadline, sequence_number, callback)
+        heapq.heappush(self.heap, (deadline, sequence_number, name))
+        self.changed.set()
+
+    def cancel(self, name: str) -> bool:
+        """Stop timer without running its callback, and return whether it was
+        active"""
+        if self.timers.pop(name, None) is None:
+            return False
+        self.changed.set()
+        return True
+
+    async def finish(self, name: str) -> bool:
+        """Stop timer and run its callback right away, and return whether it was
+        active"""
+        timer = self.timers.pop(name, None)
+        if timer is None:
+            return False
+        self.changed.set()
+        await timer[2]()
+        return True
+
+    def extend(self, name: str, delay: float) -> bool:
+        """Move timer's deadline delay seconds later (or earlier if negative), and
+        return whether it was active"""
+        timer = self.timers.get(name)
+        if timer is None:
+            return False
+        self._push(name, max(timer[0] + delay, self.clock()), timer[2])
+        return True
+
+    def remaining(self, name: str) -> float | None:
+        """Return seconds until timer runs out, or None if it isn't active"""
+        timer = self.timers.get(name)
+        if timer is None:
+            return None
+        return max(timer[0] - self.clock(), 0)
+
+    def remaining_all(self) -> dict[str, float]:
+        return {name: self.remaining(name) for name in self.timers}
+
+    async def run(self) -> None:
+        """Run callbacks of timers as they run out, forever"""
+        while True:
+            self.changed.clear()
+            now = self.clock()
+            while len(self.heap) > 0:
+                deadline, sequence_number, name = self.heap[0]
+                timer = self.timers.get(name)
+                if timer is not None and timer[1] == sequence_number:
+                    if deadline > now:
+                        break
+                    del self.timers[name]
+                    self._start_callback(name, timer[2])
+                heapq.heappop(self.heap)
+
+            timeout = None
+            if len(self.heap) > 0:
+                timeout = self.heap[0][0] - now
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_callback(self, name: str, callback: Callable[[], Coroutine]) -> None:
+        task = asyncio.ensure_future(callback())
+        self.running.add(task)
+
+        def done(task: asyncio.Task) -> None:
+            self.running.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                print(f'Error when timer "{name}" ran out: {task.exception()}')
+
+        task.add_done_callback(done)
@@ -0,0 +1,123 @@
+import argparse
+import glob
+import json
+
+import numpy as np
+
+"""
+Summarize trace file written with main.py --trace: how long each kind of span takes,
+what decisions ticks made, and where the time went in the slowest ticks.
+
+Run with python3 trace_summary.py trace.jsonl
+"""
+
+
+def load_spans(file_path: str) -> list[dict]:
+    """Return spans in trace file and its rotated backups, oldest first"""
+    spans = []
+    # backups are file_path.1 (newest) to file_path.N (oldest)
+    backups = [
+        path for path in glob.glob(f"{file_path}.*") if path.rsplit(".", 1)[1].isdigit()
+    ]
+    backups.sort(key=lambda path: int(path.rsplit(".", 1)[1]), reverse=True)
+    for path in backups + [file_path]:
+        with open(path) as f:
+            for line in f:
+                if line.strip() != "":
+                    spans.append(json.loads(line))
+    return spans
+
+
+def print_span_stats(spans: list[dict]) -> None:
+    durations: dict[str, list[float]] = {}
+    for span in spans:
+        durations.setdefault(span["name"], []).append(span["duration_ms"])
+
+    print(
+        f"{'span':<24}{'count':>8}{'p50 (ms)':>11}{'p95 (ms)':>11}{'max (ms)':>11}"
+        f"{'total (s)':>11}"
+    )
+    for name, values in sorted(
+        durations.items(), key=lambda item: sum(item[1]), reverse=True
+    ):
+        print(
+            f"{name:<24}{len(values):>8}{np.percentile(values, 50):>11.1f}"
+            f"{np.percentile(values, 95):>11.1f}{max(values):>11.1f}"
+            f"{sum(values) / 1000:>11.1f}"
+        )
+
+
+def print_slowest_ticks(spans: list[dict], num_ticks: int) -> None:
+    children: dict[int, list[dict]] = {}
+    for span in spans:
+        if span["parent_id"] is not None:
+            children.setdefault(span["parent_id"], []).append(span)
+
+    def print_tree(span: dict, depth: int) -> None:
+        details = ", ".join(
+            f"{key}={value}"
+            for key, value in span.items()
+            if key
+            not in [
+                "name",
+                "trace_id",
+                "span_id",
+                "parent_id",
+                "start",
+                "duration_ms",
+                "thread",
+            ]
+        )
+        print(f"{'  ' * depth}{span['name']} {span['duration_ms']}ms  {details}")
+        for child in sorted(
+            children.get(span["span_id"], []), key=lambda s: s["start"]
+        ):
+            print_tree(child, depth + 1)
+
+    ticks = [span for span in spans if span["name"] == "tick"]
+    if len(ticks) == 0:
+        return
+
+    decisions: dict[str, int] = {}
+    for tick in ticks:
+        decision = tick.get("decision", "unknown")
+        decisions[decision] = decisions.get(decision, 0) + 1
+    print(
+        f"\n{len(ticks)} ticks: " + ", ".join(f"{n} {d}" for d, n in decisions.items())
+    )
+
+    print(f"\nSlowest {min(num_ticks, len(ticks))} ticks:")
+    for tick in sorted(ticks, key=lambda s: s["duration_ms"], reverse=True)[:num_ticks]:
+        print()
+        print_tree(tick, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarize trace file")
+    parser.add_argument("file_path", help="Path of trace file")
+    parser.add_argument(
+        "-n", "--num-ticks", type=int, default=5, help="Number of slowest ticks to show"
+    )
+    parser.add_argument(
+        "-d", "--decision", help="Only show ticks with this decision (e.g. switch_away)"
+    )
+    args = parser.parse_args()
+
+    spans = load_spans(args.file_path)
+    if args.decision is not None:
+        trace_ids = {
+            span["trace_id"]
+            for span in spans
+            if span["name"] == "tick" and span.get("decision") == args.decision
+        }
+        spans = [span for span in spans if span["trace_id"] in trace_ids]
+    if len(spans) == 0:
+        print("No spans found.")
+        return
+
+    print_span_stats(spans)
+    print_slowest_ticks(spans, args.num_ticks)
+
+
+if __name__ == "__main__":
+    main()
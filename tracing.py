@@ -0,0 +1,167 @@
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from threading import current_thread
+from typing import Callable, Iterator
+
+from constants import TRACE_BACKUP_COUNT, TRACE_MAX_BYTES
+
+"""
+Opt-in tracing of what happens during each main loop tick. Each span is written as one
+line of JSON to a rotating file when it ends, with its duration and the span it was
+started in, so slow ticks can be broken down into screenshots, cropping, model
+predictions and yabai/brave-cli calls. Enable with main.py --trace, and summarize
+with trace_summary.py.
+"""
+
+
+class Span:
+    def __init__(
+        self, name: str, trace_id: int, parent_id: int | None, attrs: dict
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = next(span_ids)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration_ms": round(duration * 1000, 3),
+            "thread": current_thread().name,
+            **self.attrs,
+        }
+
+
+class NoopSpan:
+    """Returned while tracing is disabled so that instrumented code costs nothing"""
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+span_ids = itertools.count(1)
+logger = logging.getLogger("redzone.tracing")
+logger.propagate = False
+# spans started and not yet ended in each thread (or asyncio task), innermost last
+open_spans: ContextVar[tuple[Span, ...]] = ContextVar("open_spans", default=())
+enabled = False
+
+
+def enable(
+    file_path: str,
+    max_bytes: int = TRACE_MAX_BYTES,
+    backup_count: int = TRACE_BACKUP_COUNT,
+) -> None:
+    """Start writing spans to file_path, rotating it once it reaches max_bytes and
+    keeping backup_count old files (file_path.1, file_path.2, ...)"""
+    global enabled
+
+    directory = os.path.dirname(file_path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    handler = RotatingFileHandler(
+        file_path, maxBytes=max_bytes, backupCount=backup_count
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    enabled = True
+    print(f"Writing traces to {file_path}.")
+
+
+def current_span() -> Span | NoopSpan:
+    stack = open_spans.get()
+    if not enabled or len(stack) == 0:
+        return NoopSpan()
+    return stack[-1]
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span | NoopSpan]:
+    """Time the code in the with block as a span named name, nested in the span that
+    is currently open in this thread or asyncio task (if any)"""
+    if not enabled:
+        yield NoopSpan()
+        return
+
+    stack = open_spans.get()
+    if len(stack) > 0:
+        new_span = Span(name, stack[-1].trace_id, stack[-1].span_id, attrs)
+    else:
+        new_span = Span(name, 0, None, attrs)
+        new_span.trace_id = new_span.span_id
+
+    token = open_spans.set(stack + (new_span,))
+    start = time.perf_counter()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        open_spans.reset(token)
+        logger.info(json.dumps(new_span.to_dict(duration), default=str))
+
+
+def in_current_span(func: Callable) -> Callable:
+    """Return function that runs func nested in the span that is open now, for
+    running it in another thread (e.g. a worker pool)"""
+    if not enabled:
+        return func
+
+    parent_stack = open_spans.get()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = open_spans.set(parent_stack)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            open_spans.reset(token)
+
+    return wrapper
+
+
+def traced(name: str | None = None) -> Callable:
+    """Decorator to record each call of the function as a span, with its arguments
+    that are numbers, strings or booleans as attributes"""
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        span_name = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            attrs = {
+                arg_name: value
+                for arg_name, value in bound.arguments.items()
+                if isinstance(value, (int, float, str, bool)) and arg_name != "self"
+            }
+            with span(span_name, **attrs):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,15 +1,28 @@
+import functools
 import json
 import os
 import subprocess
 import time
+import urllib.request
 
 from simple_term_menu import TerminalMenu
 
+import metrics
+import tracing
+from constants import BROWSER_DEBUGGING_PORT
+
 NOTIFICATION_TITLE = "NBARedZone"
 ITERM_PROFILE = "ML-RedZone Placeholder"
+# returned by page_controller_call expressions when javascript/controller.js hasn't
+# been injected in the page yet (or the page reloaded)
+PAGE_CONTROLLER_MISSING = "__redzone_missing"
 
 
 def run_shell(command: str, check: bool = True, shell: bool = False) -> str:
+    words = command.split()
+    if len(words) == 0:
+        raise Exception("Unable to run empty shell command")
+
     # split command into list with each element containing a word, except if command
     # contains quotes, in which case quoted part must be in one element of list. Also
     # don't split if shell=True
@@ -41,34 +54,70 @@ def run_shell(command: str, check: bool = True, shell: bool = False) -> str:
         if current_word != "":
             command_list.append(current_word)
     else:
-        command_list = command.split()
+        command_list = words
 
-    result = subprocess.run(
-        command_list, capture_output=True, text=True, check=check, shell=shell
+    # label metrics by program run, skipping environment variables set before it
+    program = next((word for word in words if "=" not in word), words[0])
+    program = os.path.basename(program)
+    start = time.time()
+    try:
+        result = subprocess.run(
+            command_list, capture_output=True, text=True, check=check, shell=shell
+        )
+    except subprocess.CalledProcessError:
+        metrics.shell_commands.inc(program=program, success="false")
+        raise
+    finally:
+        metrics.shell_command_seconds.observe(time.time() - start, program=program)
+    metrics.shell_commands.inc(
+        program=program, success=str(result.returncode == 0).lower()
     )
 
     return result.stdout
 
 
+@functools.cache
+def load_script(js_file: str) -> str:
+    """Return contents of JS file, only reading it from disk the first time"""
+    with open(js_file) as f:
+        return f.read()
+
+
+def chrome_cli_run(js_code: str, id: int) -> str:
+    # JS code can't contain single quotes, since it is passed in them
+    return run_shell(f"brave-cli execute '{js_code}' -t {id}")
+
+
 def chrome_cli_execute(js_file: str, id: int, context_dict: dict[str, str]) -> str:
     # run JS code in given file on browser tab with given ID, passing variables to
     # replace in JS file via context_dict parameter
-    with open(js_file) as f:
-        js_code = "\n" + f.read()
+    js_code = "\n" + load_script(js_file)
 
     for var_name, value in context_dict.items():
         js_code = js_code.replace(var_name, value)
 
-    return run_shell(f"brave-cli execute '{js_code}' -t {id}")
+    return chrome_cli_run(js_code, id)
 
 
-def control_stream_audio(chrome_cli_id: int, mute: bool = True) -> None:
-    if mute:
-        var_dict = {"MUTE_STREAM": "true"}
-    else:
-        var_dict = {"MUTE_STREAM": "false"}
+def page_controller_call(method: str) -> str:
+    """Return JS expression calling method of window.__redzone, the controller that
+    javascript/controller.js injects in stream pages"""
+    return f'(window.__redzone ? window.__redzone.{method}() : "{PAGE_CONTROLLER_MISSING}")'
 
-    chrome_cli_execute("javascript/mute.js", chrome_cli_id, var_dict)
+
+def call_page_controller(chrome_cli_id: int, method: str) -> str:
+    """Call method of page controller in tab with brave-cli, injecting the controller
+    first if needed"""
+    result = chrome_cli_run(page_controller_call(method), chrome_cli_id).strip()
+    if result == PAGE_CONTROLLER_MISSING:
+        chrome_cli_execute("javascript/controller.js", chrome_cli_id, {})
+        result = chrome_cli_run(page_controller_call(method), chrome_cli_id).strip()
+    return result
+
+
+@tracing.traced()
+def control_stream_audio(chrome_cli_id: int, mute: bool = True) -> None:
+    call_page_controller(chrome_cli_id, "mute" if mute else "unmute")
 
 
 def get_window_video_elements(chrome_cli_id: int) -> dict:
@@ -77,8 +126,7 @@ def get_window_video_elements(chrome_cli_id: int) -> dict:
     video elements, not iframes via JavaScript. So it's important to have a stream
     be displayed in a video and not an iframe in order to programmatically mute/unmute it.
     """
-    result = chrome_cli_execute("javascript/video_elements.js", chrome_cli_id, {})
-    return json.loads(result)
+    return json.loads(call_page_controller(chrome_cli_id, "state"))
 
 
 def notify(text: str, title: str = NOTIFICATION_TITLE) -> None:
@@ -103,7 +151,13 @@ def open_stream_windows(urls: list[str], space: int) -> list[dict]:
 
     wins_before = get_all_brave_windows()
     for url in urls:
-        run_shell(f"open -a 'Brave Browser.app' -n --args --new-window --app='{url}'")
+        # debugging port lets BrowserController control tabs without brave-cli (only
+        # takes effect if Brave isn't already running, and recent versions ignore it
+        # for the default profile, so check whether it's open below)
+        run_shell(
+            f"open -a 'Brave Browser.app' -n --args --new-window --app='{url}'"
+            f" --remote-debugging-port={BROWSER_DEBUGGING_PORT}"
+        )
 
     wins_after = wins_before
     new_windows = []
@@ -120,9 +174,27 @@ def open_stream_windows(urls: list[str], space: int) -> list[dict]:
     for win in new_windows:
         run_shell(f"yabai -m window {win['id']} --space {space}")
 
+    if not devtools_listening(BROWSER_DEBUGGING_PORT):
+        print(
+            f"Brave isn't listening on DevTools port {BROWSER_DEBUGGING_PORT} (it was"
+            " already running without --remote-debugging-port, or ignores it for the"
+            " default profile), so tabs will be controlled with brave-cli."
+        )
+
     return new_windows
 
 
+def devtools_listening(port: int) -> bool:
+    """Whether a browser DevTools endpoint answers on given port"""
+    try:
+        with urllib.request.urlopen(
+            f"http://localhost:{port}/json/version", timeout=1
+        ) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
 def convert_open_windows_to_minimal(space: int) -> list[dict]:
     """Convert all tabs in given space to minimal browser windows"""
     space_wins = get_windows(space, title=True)
@@ -140,19 +212,91 @@ def convert_open_windows_to_minimal(space: int) -> list[dict]:
     return open_stream_windows(tab_urls, space)
 
 
+class YabaiBatch:
+    """Collects yabai window commands for one logical action and runs them in as few
+    yabai invocations as possible. yabai can chain commands for the same window
+    (e.g. yabai -m window 123 --move abs:0:0 --resize abs:800:600 --focus), so
+    consecutive commands for one window are sent together, while commands for
+    different windows stay in the order they were added (focus order decides which
+    window ends up on top). Commands that are undone or overridden before they run are
+    dropped.
+
+    Use as a context manager to run the commands when the with block ends.
+    """
+
+    # commands where only the last one for a window matters
+    LAST_WINS = ["--move", "--resize", "--space"]
+
+    def __init__(self) -> None:
+        # window ID and command arguments, in order
+        self.commands: list[tuple[int, list[str]]] = []
+
+    def __enter__(self) -> "YabaiBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.run()
+
+    def add(self, win_id: int, *args: str) -> None:
+        command = list(args)
+        repeated = len(self.commands) > 0 and self.commands[-1] == (win_id, command)
+        if repeated and command[0] == "--toggle":
+            # toggling the same thing twice in a row does nothing
+            self.commands.pop()
+            return
+        if repeated and command[0] == "--focus":
+            return
+        if command[0] in self.LAST_WINS:
+            self._drop_previous(win_id, command[0])
+        self.commands.append((win_id, command))
+
+    def _drop_previous(self, win_id: int, name: str) -> None:
+        """Remove earlier command with given name for window, unless a command for
+        another window ran after it (the order might matter then)"""
+        for index in range(len(self.commands) - 1, -1, -1):
+            other_id, command = self.commands[index]
+            if other_id != win_id:
+                return
+            if command[0] == name:
+                del self.commands[index]
+                return
+
+    def invocations(self) -> list[str]:
+        """Return yabai commands to run, merging consecutive commands for the same
+        window"""
+        invocations: list[tuple[int, list[str]]] = []
+        for win_id, command in self.commands:
+            if len(invocations) > 0 and invocations[-1][0] == win_id:
+                invocations[-1][1].extend(command)
+            else:
+                invocations.append((win_id, list(command)))
+        return [
+            f"yabai -m window {win_id} {' '.join(args)}" for win_id, args in invocations
+        ]
+
+    def run(self) -> None:
+        invocations = self.invocations()
+        self.commands = []
+        if len(invocations) > 0:
+            with tracing.span("yabai_batch", invocations=len(invocations)):
+                for invocation in invocations:
+                    run_shell(invocation)
+
+
 # TODO: split some of these into separate classes/files? Like chrome-cli or cover stuff
 def open_commercial_cover(space: int, windows: list[dict]) -> int:
     res_text = run_shell(
         f'osascript -e \'tell application "iTerm" to create window with profile "{ITERM_PROFILE}"\''
     )
     win_id = int(res_text.split()[-1])
-    # TODO: condense in one yabai command? Seems like you can chain them
-    run_shell(f"yabai -m window {win_id} --toggle float")
-    run_shell(f"yabai -m window {win_id} --space {space}")
+    with YabaiBatch() as batch:
+        batch.add(win_id, "--toggle", "float")
+        batch.add(win_id, "--space", str(space))
 
-    # focus all other windows in space to put cover behind them all
-    for win in windows:
-        run_shell(f"yabai -m window {win['id']} --focus")
+        # focus all other windows in space to put cover behind them all
+        for win in windows:
+            batch.add(win["id"], "--focus")
 
     return win_id
 
@@ -161,14 +305,24 @@ def close_window(win_id: int) -> None:
     run_shell(f"yabai -m window {win_id} --close")
 
 
-def cover_window(win_id: int, cover_id: int) -> None:
-    # TODO: probably pass this as an argument? Don't run query here
+def get_window_frame(win_id: int) -> dict:
+    """Return position and size of window (x, y, w and h keys)"""
     win_info = json.loads(run_shell(f"yabai -m query --windows --window {win_id}"))
-    coords = win_info["frame"]
+    return win_info["frame"]
+
+
+@tracing.traced()
+def cover_window(coords: dict, cover_id: int, batch: YabaiBatch | None = None) -> None:
+    """Move cover window to given frame (e.g. from get_window_frame) and focus it. If
+    batch is given, the commands are added to it instead of run right away."""
+    if batch is None:
+        with YabaiBatch() as own_batch:
+            cover_window(coords, cover_id, own_batch)
+        return
 
-    run_shell(f"yabai -m window {cover_id} --move abs:{coords['x']}:{coords['y']}")
-    run_shell(f"yabai -m window {cover_id} --resize abs:{coords['w']}:{coords['h']}")
-    run_shell(f"yabai -m window {cover_id} --focus")
+    batch.add(cover_id, "--move", f"abs:{coords['x']}:{coords['y']}")
+    batch.add(cover_id, "--resize", f"abs:{coords['w']}:{coords['h']}")
+    batch.add(cover_id, "--focus")
 
 
 def strip_win_title(title: str) -> str:
@@ -289,8 +443,12 @@ def choose_main_window_id(windows: list[dict]) -> tuple[int, str]:
     return windows[choice_index]["id"], title
 
 
+@tracing.traced()
 def get_windows(
-    space: int | None = None, title: bool = False, app: bool = False
+    space: int | None = None,
+    title: bool = False,
+    app: bool = False,
+    frame: bool = False,
 ) -> list[dict]:
     command = "yabai -m query --windows"
     if space is not None:
@@ -306,12 +464,14 @@ def get_windows(
         for win in windows
     ]
 
-    if title or app:
+    if title or app or frame:
         for index, win in enumerate(windows):
             if title:
                 windows_info[index]["title"] = win["title"]
             if app:
                 windows_info[index]["app"] = win["app"]
+            if frame:
+                windows_info[index]["frame"] = win["frame"]
 
     return windows_info
 
@@ -0,0 +1,102 @@
+import time
+from threading import Lock, Thread
+
+from constants import WINDOW_RECONCILE_INTERVAL
+from utils import get_window_frame, get_windows
+
+
+class WindowRegistry:
+    """Keeps ID, frame, focus and fullscreen state of the windows in a space in memory,
+    so that actions don't have to query yabai every time. StreamManager updates it when
+    it changes windows itself and when yabai signals that a window was focused or
+    resized, and it is reconciled with yabai every WINDOW_RECONCILE_INTERVAL seconds to
+    catch anything else.
+    """
+
+    def __init__(
+        self, space: int, reconcile_interval: float = WINDOW_RECONCILE_INTERVAL
+    ) -> None:
+        self.space = space
+        self.reconcile_interval = reconcile_interval
+        self.lock = Lock()
+        # keys: window IDs in the order yabai lists them, values: same dicts as
+        # utils.get_windows(frame=True), with frame set to None when it is out of date
+        self.windows: dict[int, dict] = {}
+        self.last_refresh = 0.0
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Replace state of all windows with what yabai reports"""
+        windows = get_windows(self.space, frame=True)
+        with self.lock:
+            self.windows = {win["id"]: win for win in windows}
+            self.last_refresh = time.monotonic()
+
+    def start_reconciling(self) -> None:
+        Thread(target=self._reconcile_forever, daemon=True).start()
+
+    def _reconcile_forever(self) -> None:
+        while True:
+            # explicit refreshes (e.g. when toggling fullscreen) count as reconciling,
+            # so wait a full interval after the latest one
+            with self.lock:
+                delay = self.last_refresh + self.reconcile_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+                continue
+
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Unable to reconcile window registry: {e}")
+                time.sleep(self.reconcile_interval)
+
+    def get_windows(self) -> list[dict]:
+        """Return ID, focus and fullscreen state of each window, like
+        utils.get_windows"""
+        with self.lock:
+            return [
+                {
+                    "id": win["id"],
+                    "focus": win["focus"],
+                    "fullscreen": win["fullscreen"],
+                }
+                for win in self.windows.values()
+            ]
+
+    def frame(self, win_id: int) -> dict:
+        """Return position and size of window, only querying yabai if it may have moved
+        since it was last known"""
+        with self.lock:
+            win = self.windows.get(win_id)
+            if win is not None and win["frame"] is not None:
+                return dict(win["frame"])
+
+        frame = get_window_frame(win_id)
+        with self.lock:
+            if win_id in self.windows:
+                self.windows[win_id]["frame"] = frame
+        return dict(frame)
+
+    def set_focused(self, win_id: int) -> None:
+        with self.lock:
+            for win in self.windows.values():
+                win["focus"] = win["id"] == win_id
+
+    def set_fullscreen(self, win_id: int, fullscreen: bool) -> None:
+        with self.lock:
+            if win_id in self.windows:
+                self.windows[win_id]["fullscreen"] = fullscreen
+                self.windows[win_id]["frame"] = None
+
+    def toggle_fullscreen(self, win_id: int) -> None:
+        with self.lock:
+            fullscreen = self.windows.get(win_id, {}).get("fullscreen", False)
+        self.set_fullscreen(win_id, not fullscreen)
+
+    def frame_changed(self, win_id: int) -> None:
+        """Forget frame of window (e.g. because it was resized), so that it is queried
+        next time it's needed"""
+        with self.lock:
+            if win_id in self.windows:
+                self.windows[win_id]["frame"] = None